@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""Run welearn_bot end to end against a fake Moodle site and measure it
+
+Every action runs in its own home directory, once on an empty mirror
+("cold") and then again with everything downloaded ("warm"). Submissions
+run a third time once the upcoming assignments have fallen due ("due"),
+which has to fetch the submissions made to them early. For each run
+the wall time, the requests and bytes served by the fake site, and the
+peak RSS of the bot are recorded. Results are printed and saved as JSON,
+and an earlier results file can be given to compare against.
+
+    python benchmarks/e2e.py --courses 10 --modules 40 --latency 20
+    python benchmarks/e2e.py --compare benchmarks/results/before.json
+"""
+
+from argparse import ArgumentParser, Namespace
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+import json
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import tempfile
+
+from fake_moodle import FakeMoodle
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+SRC = os.path.join(ROOT, "src")
+RESULTS = os.path.join(ROOT, "benchmarks", "results")
+ACTIONS = ["files", "assignments", "submissions", "urls"]
+PHASES = ["cold", "warm"]
+
+
+def setup_parser() -> ArgumentParser:
+    parser = ArgumentParser(description="Benchmark welearn_bot against a fake site")
+    parser.add_argument("--actions", nargs="*", default=ACTIONS, help="actions to run")
+    parser.add_argument("--courses", type=int, default=5)
+    parser.add_argument("--modules", type=int, default=20, help="modules per course")
+    parser.add_argument(
+        "--participants", type=int, default=30, help="students per course"
+    )
+    parser.add_argument(
+        "--assignments", type=int, default=4, help="assignments per course"
+    )
+    parser.add_argument(
+        "--folder-files", type=int, default=5, help="files in each folder"
+    )
+    parser.add_argument(
+        "--sizes",
+        default="lognormal:200K:1.5",
+        help="file sizes, as fixed:SIZE, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--latency", type=float, default=0, help="ms added to every request"
+    )
+    parser.add_argument(
+        "--bandwidth", default="0", help="download bytes per second, e.g. 10M"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="share of requests failing with 503"
+    )
+    parser.add_argument(
+        "--bot-args", default="", help="extra arguments for welearn_bot, e.g. '-j 8'"
+    )
+    parser.add_argument("--label", default="", help="name for the results file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    return parser
+
+
+def write_config(home: str, baseurl: str, courses: List[str]) -> str:
+    """Write a .welearnrc for the fake site, returning the mirror directory"""
+    mirror = os.path.join(home, "mirror")
+    os.makedirs(mirror)
+    lines = ["[auth]", "username = bench", "password = bench", f"baseurl = {baseurl}"]
+    lines += ["", "[courses]", *courses]
+    lines += ["", "[submissions]", *(f"{course} = ALL" for course in courses)]
+    lines += ["", "[files]", f"pathprefix = {mirror}"]
+    with open(os.path.join(home, ".welearnrc"), "w") as config:
+        config.write("\n".join(lines) + "\n")
+    return mirror
+
+
+def run_bot(home: str, action: str, bot_args: List[str]) -> Dict[str, Any]:
+    """Run one action, returning its wall time, exit status and peak RSS"""
+    env = dict(os.environ, HOME=home, PYTHONPATH=SRC)
+    log_path = os.path.join(home, f"{action}.log")
+    with open(log_path, "ab") as log:
+        start = perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "welearnbot", action, "ALL", *bot_args],
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+            scale = 1 if sys.platform == "darwin" else 1024
+            peak_rss: Optional[int] = usage.ru_maxrss * scale
+        else:
+            process.wait()
+            peak_rss = None
+        wall = perf_counter() - start
+
+    if process.returncode:
+        with open(log_path, errors="replace") as log:
+            tail = log.read()[-2000:]
+        print(f"{action} exited with {process.returncode}:\n{tail}", file=sys.stderr)
+    return {"wall": wall, "returncode": process.returncode, "peak_rss": peak_rss}
+
+
+def run_benchmark(args: Namespace) -> Dict[str, Any]:
+    from welearnbot.utils import parse_size
+
+    bot_args = shlex.split(args.bot_args)
+    fake = FakeMoodle(
+        latency=args.latency / 1000,
+        bandwidth=parse_size(args.bandwidth),
+        error_rate=args.error_rate,
+        courses=args.courses,
+        modules=args.modules,
+        participants=args.participants,
+        assignments=args.assignments,
+        folder_files=args.folder_files,
+        sizes=args.sizes,
+        seed=args.seed,
+    )
+    courses = [course["shortname"] for course in fake.site.courses]
+    site_bytes = sum(file.size for file in fake.site.files.values())
+    print(
+        f"{len(courses)} courses, {len(fake.site.files)} files, "
+        f"{site_bytes / (1 << 20):.1f} MB on {fake.baseurl}"
+    )
+
+    results = []
+    with fake, tempfile.TemporaryDirectory(prefix="welearn-bench-") as tmp:
+        for action in args.actions:
+            home = os.path.join(tmp, action)
+            os.makedirs(home)
+            write_config(home, fake.baseurl, courses)
+            for phase in PHASES:
+                results.append(measure(fake, home, action, phase, bot_args))
+            if action == "submissions":
+                with fake.site.all_due():
+                    results.append(measure(fake, home, action, "due", bot_args))
+
+    return {
+        "label": args.label,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "site": {
+            "courses": args.courses,
+            "modules": args.modules,
+            "participants": args.participants,
+            "assignments": args.assignments,
+            "folder_files": args.folder_files,
+            "sizes": args.sizes,
+            "seed": args.seed,
+            "files": len(fake.site.files),
+            "bytes": site_bytes,
+        },
+        "network": {
+            "latency_ms": args.latency,
+            "bandwidth": args.bandwidth,
+            "error_rate": args.error_rate,
+        },
+        "bot_args": bot_args,
+        "results": results,
+    }
+
+
+def measure(
+    fake: FakeMoodle, home: str, action: str, phase: str, bot_args: List[str]
+) -> Dict[str, Any]:
+    """Run one action and count what the fake site served for it"""
+    fake.reset_stats()
+    run = run_bot(home, action, bot_args)
+    run.update(
+        action=action,
+        phase=phase,
+        requests=sum(fake.requests.values()),
+        bytes=sum(fake.bytes_sent.values()),
+        requests_by_kind=dict(fake.requests),
+    )
+    report(run)
+    return run
+
+
+def report(run: Dict[str, Any]) -> None:
+    rss = f"{run['peak_rss'] / (1 << 20):.1f} MB" if run["peak_rss"] else "-"
+    print(
+        f"{run['action']:<12} {run['phase']:<5} {run['wall']:>8.2f} s "
+        f"{run['requests']:>7} requests {run['bytes'] / (1 << 20):>9.1f} MB "
+        f"peak RSS {rss}" + (" FAILED" if run["returncode"] else "")
+    )
+
+
+def compare(baseline_path: str, current: Dict[str, Any]) -> None:
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    before = {(run["action"], run["phase"]): run for run in baseline["results"]}
+    print(f"\nCompared with {baseline_path} ({baseline.get('commit', '?')[:10]})")
+    for run in current["results"]:
+        old = before.get((run["action"], run["phase"]))
+        if old is None:
+            continue
+        change = (run["wall"] - old["wall"]) / old["wall"] * 100 if old["wall"] else 0
+        print(
+            f"{run['action']:<12} {run['phase']:<5} {old['wall']:>8.2f} s -> "
+            f"{run['wall']:>8.2f} s ({change:+.1f}%), requests "
+            f"{old['requests']} -> {run['requests']}"
+        )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main() -> int:
+    args = setup_parser().parse_args()
+    results = run_benchmark(args)
+
+    os.makedirs(RESULTS, exist_ok=True)
+    name = args.label or datetime.now().strftime("%Y%m%d-%H%M%S")
+    results_path = os.path.join(RESULTS, f"{name}.json")
+    with open(results_path, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Saved results to {os.path.normpath(results_path)}")
+
+    if args.compare:
+        compare(args.compare, results)
+    return 1 if any(run["returncode"] for run in results["results"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
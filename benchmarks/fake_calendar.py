@@ -0,0 +1,237 @@
+"""A stand-in for the Google Calendar API, and checks of `CalendarSync` against it
+
+`FakeCalendar` keeps events in memory and answers the calls made by
+`welearnbot.gcal.CalendarSync`: `events().list` with paging and sync
+tokens, `events().insert`, `events().patch` and batch requests of at most
+50 calls. Sync tokens can be expired to make `list` fail with 410 Gone,
+as Google does. Running this script checks that nothing is sent while no
+assignment is due, then publishes assignments through a fake calendar in
+a temporary home directory, reschedules, deletes and resyncs them, and
+fails if any step sends the wrong requests.
+
+    python benchmarks/fake_calendar.py
+"""
+
+from collections import Counter
+from configparser import RawConfigParser
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import io
+import os
+import sys
+import tempfile
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+)
+
+from welearnbot.gcal import CalendarSync
+
+MAX_BATCH = 50
+# Times without an offset are returned in the zone of the event
+OFFSET = "+05:30"
+
+
+class FakeRequest:
+    """A call that runs when executed, like `googleapiclient.http.HttpRequest`"""
+
+    def __init__(self, call: Callable[[], Any]) -> None:
+        self.call = call
+
+    def execute(self) -> Any:
+        return self.call()
+
+
+class FakeBatch:
+    def __init__(self, calendar: "FakeCalendar") -> None:
+        self.calendar = calendar
+        self.requests: List[tuple] = []
+
+    def add(self, request: FakeRequest, callback: Callable, request_id: str) -> None:
+        if len(self.requests) == MAX_BATCH:
+            raise ValueError(f"A batch holds at most {MAX_BATCH} requests")
+        self.requests.append((request, callback, request_id))
+
+    def execute(self) -> None:
+        self.calendar.calls["batch"] += 1
+        for request, callback, request_id in self.requests:
+            try:
+                response = request.execute()
+            except HttpError as error:
+                callback(request_id, None, error)
+            else:
+                callback(request_id, response, None)
+
+
+class FakeEvents:
+    def __init__(self, calendar: "FakeCalendar") -> None:
+        self.calendar = calendar
+
+    def list(self, **kwargs) -> FakeRequest:
+        return FakeRequest(lambda: self.calendar.list(**kwargs))
+
+    def insert(self, calendarId: str, body: Dict[str, Any]) -> FakeRequest:
+        return FakeRequest(lambda: self.calendar.insert(body))
+
+    def patch(
+        self, calendarId: str, eventId: str, body: Dict[str, Any]
+    ) -> FakeRequest:
+        return FakeRequest(lambda: self.calendar.patch(eventId, body))
+
+
+class FakeCalendar:
+    """One calendar's events, served like the Calendar API service object
+
+    Every change stamps the event with a sequence number, and a sync token
+    holds the sequence number it was issued at, so an incremental `list`
+    returns the events changed since, including cancelled ones. `calls`
+    counts the requests by kind.
+    """
+
+    def __init__(self, page_size: int = 2500) -> None:
+        self.page_size = page_size
+        self.store: Dict[str, Dict[str, Any]] = {}
+        self.sequence = 0
+        # Sync tokens of an earlier epoch are rejected with 410 Gone
+        self.epoch = 0
+        self.calls: Counter = Counter()
+
+    def events(self) -> FakeEvents:
+        return FakeEvents(self)
+
+    def new_batch_http_request(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def stamp(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        self.sequence += 1
+        event["sequence"] = self.sequence
+        return dict(event)
+
+    @staticmethod
+    def times(body: Dict[str, Any]) -> Dict[str, Any]:
+        times = {}
+        for key in ("start", "end"):
+            if key in body:
+                moment = dict(body[key])
+                if moment["dateTime"][-6] not in "+-":
+                    moment["dateTime"] += OFFSET
+                times[key] = moment
+        return times
+
+    def insert(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        self.calls["insert"] += 1
+        event_id = f"event{len(self.store) + 1}"
+        event = dict(body, id=event_id, status="confirmed", **self.times(body))
+        self.store[event_id] = event
+        return self.stamp(event)
+
+    def patch(self, event_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        self.calls["patch"] += 1
+        event = self.store[event_id]
+        event.update(body, **self.times(body))
+        return self.stamp(event)
+
+    def delete(self, event_id: str) -> None:
+        """Delete an event, as a user would in the calendar"""
+        self.store[event_id]["status"] = "cancelled"
+        self.stamp(self.store[event_id])
+
+    def expire_sync_tokens(self) -> None:
+        self.epoch += 1
+
+    def list(
+        self,
+        calendarId: str,
+        maxResults: int = 250,
+        pageToken: Optional[str] = None,
+        syncToken: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        self.calls["list"] += 1
+        if syncToken is not None:
+            epoch, since = map(int, syncToken.split(":"))
+            if epoch != self.epoch:
+                raise HttpError(httplib2.Response({"status": 410}), b"Gone")
+            events = [e for e in self.store.values() if e["sequence"] > since]
+        else:
+            self.calls["full list"] += 1
+            # A full sync leaves out deleted events
+            events = [e for e in self.store.values() if e["status"] != "cancelled"]
+        start = int(pageToken or 0)
+        end = start + min(maxResults, self.page_size)
+        page: Dict[str, Any] = {"items": [dict(e) for e in events[start:end]]}
+        if end < len(events):
+            page["nextPageToken"] = str(end)
+        else:
+            page["nextSyncToken"] = f"{self.epoch}:{self.sequence}"
+        return page
+
+
+def publish(calendar: FakeCalendar, due: Dict[int, datetime]) -> Counter:
+    """Run `CalendarSync` once for the assignments in `due`, counting requests"""
+    calendar.calls.clear()
+    sync = CalendarSync(RawConfigParser(), service=calendar, calendar_id="primary")
+    for assignment_id, duedate in due.items():
+        sync.add(duedate, "MA1101", f"Assignment {assignment_id}", assignment_id, "")
+    with redirect_stdout(io.StringIO()):
+        sync.flush()
+    return calendar.calls.copy()
+
+
+def main() -> int:
+    failures: List[str] = []
+
+    def check(step: str, calls: Counter, **expected: int) -> None:
+        got = {kind: calls[kind] for kind in expected}
+        status = "ok" if got == expected else "FAILED"
+        if got != expected:
+            failures.append(step)
+        counts = ", ".join(f"{kind} {count}" for kind, count in got.items())
+        print(f"{step:<36} {status:<7} {counts}")
+
+    with tempfile.TemporaryDirectory(prefix="welearn-gcal-") as home:
+        os.environ["HOME"] = home
+        # Without a service or a [gcal] section, building one would exit
+        built = Counter()
+        try:
+            with redirect_stdout(io.StringIO()):
+                CalendarSync(RawConfigParser()).flush()
+        except SystemExit:
+            built["service built"] += 1
+        check("nothing due", built, **{"service built": 0})
+
+        calendar = FakeCalendar(page_size=40)
+        first = datetime(2026, 11, 2, 17, 0)
+        due = {i: first + timedelta(days=i) for i in range(1, 121)}
+
+        calls = publish(calendar, due)
+        check("insert 120 new events", calls, insert=120, patch=0, batch=3)
+
+        calls = publish(calendar, due)
+        check("nothing changed", calls, insert=0, patch=0, batch=0)
+        check("  only changes are listed", calls, **{"full list": 0})
+
+        due[1] += timedelta(days=1)
+        calendar.delete("event2")
+        calls = publish(calendar, due)
+        check("move one event, recreate another", calls, insert=1, patch=1, batch=1)
+
+        calendar.expire_sync_tokens()
+        due[3] += timedelta(hours=2)
+        calls = publish(calendar, due)
+        check("expired sync token", calls, insert=0, patch=1, batch=1)
+        # One rejected incremental list, then a full sync in 40-event pages
+        check("  full sync after 410", calls, list=4, **{"full list": 3})
+
+        calls = publish(calendar, due)
+        check("  new sync token is used", calls, insert=0, patch=0, **{"full list": 0})
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,556 @@
+"""A fake Moodle site, served in-process, for benchmarking welearn_bot
+
+`FakeMoodle` answers `login/token.php`, every web service function in
+`ServerFunctions` on `webservice/rest/server.php`, and file downloads from
+`webservice/pluginfile.php`, including HTTP Range requests. Its courses,
+modules, assignments, participants and submissions are generated from a
+seed by `generate_site`, and file contents are generated on the fly, so
+large sites need no disk space. Latency is added to every request and all
+downloads share one bandwidth limit, to imitate a slow link.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep, time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import urllib.parse
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+)
+
+from moodlews.service import ServerFunctions
+from welearnbot.utils import parse_size
+
+TOKEN = "fakemoodletoken"
+USERID = 2
+BLOCK_SIZE = 64 * 1024
+PLUGINFILE = "/webservice/pluginfile.php/"
+# Everything on the site was last modified this long before it was generated
+AGE = 30 * 24 * 3600
+
+
+class SizeDistribution:
+    """File sizes following a spec such as `fixed:1M`, `uniform:10K:5M` or
+    `lognormal:200K:1.5`, the latter giving the median and the sigma"""
+
+    def __init__(self, spec: str) -> None:
+        kind, *params = spec.split(":")
+        self.kind = kind
+        if kind == "fixed" and len(params) == 1:
+            self.params = [parse_size(params[0])]
+        elif kind == "uniform" and len(params) == 2:
+            self.params = [parse_size(params[0]), parse_size(params[1])]
+        elif kind == "lognormal" and len(params) == 2:
+            self.params = [parse_size(params[0]), float(params[1])]
+        else:
+            raise ValueError(f"invalid size distribution {spec!r}")
+
+    def sample(self, rng: random.Random) -> int:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.randint(*self.params)
+        median, sigma = self.params
+        return max(1, int(median * rng.lognormvariate(0, sigma)))
+
+
+class FakeFile:
+    """A file whose contents are a block of bytes derived from its seed,
+    repeated up to its size"""
+
+    def __init__(self, path: str, filename: str, size: int, seed: int) -> None:
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.block = hashlib.sha256(str(seed).encode()).digest() * (BLOCK_SIZE // 32)
+        self._contenthash: Optional[str] = None
+
+    def chunks(self, start: int = 0) -> Iterator[bytes]:
+        position = start
+        while position < self.size:
+            offset = position % BLOCK_SIZE
+            chunk = self.block[offset : offset + self.size - position]
+            position += len(chunk)
+            yield chunk
+
+    @property
+    def contenthash(self) -> str:
+        # Hashed on first use, since large sites hold gigabytes of content
+        if self._contenthash is None:
+            digest = hashlib.sha1()
+            for chunk in self.chunks():
+                digest.update(chunk)
+            self._contenthash = digest.hexdigest()
+        return self._contenthash
+
+
+class Site:
+    """Generated content of the fake Moodle site, as plain Moodle records"""
+
+    def __init__(self, baseurl: str) -> None:
+        self.baseurl = baseurl
+        self.courses: List[Dict[str, Any]] = []
+        # courseid -> sections, assignments, participants and urls
+        self.contents: Dict[int, List[Any]] = {}
+        self.assignments: Dict[int, List[Any]] = {}
+        self.participants: Dict[int, List[Any]] = {}
+        self.urls: List[Any] = []
+        # assignment id -> submissions of every participant
+        self.submissions: Dict[int, List[Any]] = {}
+        self.files: Dict[str, FakeFile] = {}
+
+    def add_file(
+        self, rng: random.Random, component: str, filename: str, sizes: SizeDistribution
+    ) -> FakeFile:
+        path = f"{PLUGINFILE}{len(self.files) + 1}/{component}/0/{filename}"
+        fake = FakeFile(path, filename, sizes.sample(rng), rng.getrandbits(64))
+        self.files[path] = fake
+        return fake
+
+    @contextmanager
+    def all_due(self) -> Iterator[None]:
+        """Move every upcoming due date just into the past for a while
+
+        This imitates the time between two runs in which assignments fall
+        due, while their early submissions keep their old `timemodified`.
+        """
+        # Due dates are whole seconds, so the moved ones come after any
+        # earlier run, as they would between two real runs
+        sleep(1)
+        now = int(time())
+        moved = []
+        for assignments in self.assignments.values():
+            for assignment in assignments:
+                if assignment["duedate"] > now:
+                    moved.append((assignment, assignment["duedate"]))
+                    assignment["duedate"] = now
+        try:
+            yield
+        finally:
+            for assignment, duedate in moved:
+                assignment["duedate"] = duedate
+
+    def file_record(self, fake: FakeFile, timemodified: int) -> Dict[str, Any]:
+        return {
+            "type": "file",
+            "filename": fake.filename,
+            "filepath": "/",
+            "filesize": fake.size,
+            "fileurl": self.baseurl + urllib.parse.quote(fake.path),
+            "timemodified": timemodified,
+            "mimetype": "application/pdf",
+            "contenthash": fake,
+        }
+
+
+def generate_site(
+    baseurl: str,
+    courses: int = 5,
+    modules: int = 20,
+    participants: int = 30,
+    assignments: int = 4,
+    folder_files: int = 5,
+    sizes: str = "lognormal:200K:1.5",
+    submission_rate: float = 0.8,
+    seed: int = 0,
+) -> Site:
+    """Generate a site with `courses` courses of `modules` modules each
+
+    About a fifth of the modules are folders holding `folder_files` files
+    and a tenth are links; the rest are single files. Every course has
+    `assignments` assignments, half of them past due, and `participants`
+    students, each of whom submitted a file to a past due assignment with
+    probability `submission_rate`, and to an upcoming one with half that.
+    """
+    rng = random.Random(seed)
+    distribution = SizeDistribution(sizes)
+    site = Site(baseurl)
+    modified = int(time()) - AGE
+    moduleid = 0
+    userid = USERID
+
+    for courseid in range(1, courses + 1):
+        shortname = f"BM{courseid:04d}"
+        site.courses.append(
+            {
+                "id": courseid,
+                "shortname": shortname,
+                "fullname": f"Benchmark course {courseid}",
+                "isfavourite": courseid == 1,
+                "enrolledusercount": participants,
+            }
+        )
+
+        section_modules = []
+        for index in range(modules):
+            moduleid += 1
+            kind = rng.random()
+            module: Dict[str, Any] = {"id": moduleid, "name": f"Module {index + 1}"}
+            if kind < 0.1:
+                module["modname"] = "url"
+                module["contents"] = []
+                site.urls.append(
+                    {
+                        "id": moduleid,
+                        "course": courseid,
+                        "name": f"Link {index + 1}",
+                        "intro": f"<p>Reading for <b>week {index + 1}</b></p>",
+                        "externalurl": f"https://example.org/{courseid}/{index}",
+                    }
+                )
+            elif kind < 0.3:
+                module["modname"] = "folder"
+                module["contents"] = [
+                    site.file_record(
+                        site.add_file(
+                            rng, "mod_folder", f"m{moduleid}_{n}.pdf", distribution
+                        ),
+                        modified,
+                    )
+                    for n in range(folder_files)
+                ]
+            else:
+                module["modname"] = "resource"
+                module["contents"] = [
+                    site.file_record(
+                        site.add_file(
+                            rng, "mod_resource", f"m{moduleid}.pdf", distribution
+                        ),
+                        modified,
+                    )
+                ]
+            section_modules.append(module)
+        site.contents[courseid] = [
+            {"id": courseid, "name": "General", "modules": section_modules}
+        ]
+
+        students = []
+        for index in range(participants):
+            userid += 1
+            students.append(
+                {
+                    "id": userid,
+                    "fullname": f"Student {userid}",
+                    "idnumber": f"21MS{index + 1:03d}",
+                }
+            )
+        site.participants[courseid] = students
+
+        course_assignments = []
+        for index in range(assignments):
+            assignid = courseid * 1000 + index
+            # Half are past due, half are due in the coming weeks
+            duedate = int(time()) + (index - assignments // 2) * 7 * 24 * 3600
+            duedate += 24 * 3600
+            attachments = [
+                site.file_record(
+                    site.add_file(
+                        rng, "mod_assign", f"a{assignid}_{n}.pdf", distribution
+                    ),
+                    modified,
+                )
+                for n in range(rng.randint(0, 2))
+            ]
+            course_assignments.append(
+                {
+                    "id": assignid,
+                    "name": f"Assignment {index + 1}",
+                    "intro": "<p>Solve the problems from "
+                    f"<em>chapter {index + 1}</em> &amp; submit a PDF.</p>",
+                    "introattachments": attachments,
+                    "duedate": duedate,
+                    "allowsubmissionsfromdate": duedate - 14 * 24 * 3600,
+                }
+            )
+            site.submissions[assignid] = []
+            # Some students submit before the due date
+            rate = submission_rate if duedate <= time() else submission_rate / 2
+            for student in students:
+                if rng.random() >= rate:
+                    continue
+                submitted = site.add_file(
+                    rng,
+                    "assignsubmission_file",
+                    f"{student['idnumber']}_a{assignid}.pdf",
+                    distribution,
+                )
+                site.submissions[assignid].append(
+                    {
+                        "userid": student["id"],
+                        "timemodified": modified,
+                        "plugins": [
+                            {
+                                "type": "file",
+                                "name": "File submissions",
+                                "fileareas": [
+                                    {
+                                        "area": "submission_files",
+                                        "files": [
+                                            site.file_record(submitted, modified)
+                                        ],
+                                    }
+                                ],
+                            }
+                        ],
+                    }
+                )
+        site.assignments[courseid] = course_assignments
+
+    return site
+
+
+def indexed(data: Dict[str, List[str]], name: str) -> List[str]:
+    """Values of an array parameter such as `courseids[0]`, `courseids[1]`"""
+    prefix = name + "["
+    return [value[0] for key, value in sorted(data.items()) if key.startswith(prefix)]
+
+
+class FakeMoodle:
+    """Serve a generated `Site` on a local port
+
+    `latency` seconds are added to every request, and downloads share a
+    link of `bandwidth` bytes per second, or an unlimited one if it is 0.
+    A share of `error_rate` of the requests after login fail with a 503,
+    like an overloaded server would.
+    Requests and bytes sent are counted per kind of request, so one run
+    can be measured by calling `reset_stats` before it and reading
+    `requests` and `bytes_sent` after.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        bandwidth: int = 0,
+        error_rate: float = 0.0,
+        **site_options,
+    ) -> None:
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.errors = random.Random(site_options.get("seed", 0))
+        self.lock = threading.Lock()
+        self.link_free_at = 0.0
+        self.requests: Counter = Counter()
+        self.bytes_sent: Counter = Counter()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.server.daemon_threads = True
+        host, port = self.server.server_address[:2]
+        self.baseurl = f"http://{host}:{port}"
+        self.site = generate_site(self.baseurl, **site_options)
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> "FakeMoodle":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FakeMoodle":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.requests.clear()
+            self.bytes_sent.clear()
+
+    def count(self, kind: str, sent: int) -> None:
+        with self.lock:
+            self.requests[kind] += 1
+            self.bytes_sent[kind] += sent
+
+    def throttle(self, size: int) -> None:
+        """Wait until `size` bytes fit through the shared link"""
+        if not self.bandwidth:
+            return
+        with self.lock:
+            start = max(monotonic(), self.link_free_at)
+            self.link_free_at = start + size / self.bandwidth
+        sleep(max(0.0, self.link_free_at - monotonic()))
+
+    def call(self, function: str, data: Dict[str, List[str]]) -> Any:
+        """Answer a web service call like Moodle would"""
+        site = self.site
+
+        def param(name: str, default: str = "0") -> int:
+            return int(data.get(name, [default])[0])
+
+        if function == ServerFunctions.SITE_INFO:
+            return {"userid": USERID, "username": "bench", "fullname": "Bench User"}
+        if function == ServerFunctions.ALL_COURSES:
+            return {"courses": site.courses, "warnings": []}
+        if function == ServerFunctions.USER_COURSES:
+            return site.courses
+        if function == ServerFunctions.COURSE_CONTENTS:
+            return site.contents.get(param("courseid"), [])
+        if function == ServerFunctions.ASSIGNMENTS:
+            courseids = [int(value) for value in indexed(data, "courseids")]
+            return {
+                "courses": [
+                    dict(course, assignments=site.assignments[course["id"]])
+                    for course in site.courses
+                    if not courseids or course["id"] in courseids
+                ],
+                "warnings": [],
+            }
+        if function == ServerFunctions.ASSIGNMENT_STATUS:
+            # The bench user has not submitted anything
+            filearea = {"area": "submission_files", "files": []}
+            plugin = {"name": "File submissions", "fileareas": [filearea]}
+            return {"lastattempt": {"submission": {"plugins": [plugin]}}}
+        if function == ServerFunctions.SUBMISSIONS:
+            since = param("since")
+            return {
+                "assignments": [
+                    {
+                        "assignmentid": int(assignid),
+                        "submissions": [
+                            submission
+                            for submission in site.submissions.get(int(assignid), [])
+                            if submission["timemodified"] > since
+                        ],
+                    }
+                    for assignid in indexed(data, "assignmentids")
+                ],
+                "warnings": [],
+            }
+        if function == ServerFunctions.URLS:
+            return {"urls": site.urls, "warnings": []}
+        if function == ServerFunctions.RESOURCES:
+            return {
+                "resources": [
+                    {"id": module["id"], "course": courseid, "name": module["name"]}
+                    for courseid, sections in site.contents.items()
+                    for section in sections
+                    for module in section["modules"]
+                    if module["modname"] == "resource"
+                ],
+                "warnings": [],
+            }
+        if function == ServerFunctions.COURSE_USERS:
+            return site.participants.get(param("courseid"), [])
+        if function == ServerFunctions.COURSE_UPDATES:
+            # Nothing changes after the site is generated
+            return {"instances": [], "warnings": []}
+        return {
+            "exception": "dml_missing_record_exception",
+            "errorcode": "invalidrecord",
+            "message": "Can't find data record in database table "
+            "external_functions.",
+        }
+
+    def handler_class(self) -> type:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections alive, as Moodle behind a web server would
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def form(self) -> Dict[str, List[str]]:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode() if length else ""
+                query = urllib.parse.urlsplit(self.path).query
+                return urllib.parse.parse_qs("&".join(filter(None, [body, query])))
+
+            def send_json(self, kind: str, payload: Any) -> None:
+                body = json.dumps(payload, default=contenthash).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                fake.count(kind, len(body))
+
+            def do_GET(self) -> None:
+                self.do_POST()
+
+            def do_POST(self) -> None:
+                data = self.form()
+                if fake.latency:
+                    sleep(fake.latency)
+                path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+                if path == "/login/token.php":
+                    self.send_json("login", {"token": TOKEN})
+                elif fake.error_rate and fake.errors.random() < fake.error_rate:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    fake.count("error", 0)
+                elif data.get("wstoken", data.get("token", [""]))[0] != TOKEN:
+                    self.send_json(
+                        "invalidtoken",
+                        {
+                            "exception": "moodle_exception",
+                            "errorcode": "invalidtoken",
+                            "message": "Invalid token - token not found",
+                        },
+                    )
+                elif path == "/webservice/rest/server.php":
+                    function = data.get("wsfunction", [""])[0]
+                    self.send_json(function, fake.call(function, data))
+                elif path in fake.site.files:
+                    self.send_file(fake.site.files[path])
+                else:
+                    self.send_error(404)
+
+            def send_file(self, file: FakeFile) -> None:
+                start, status = self.requested_range(file.size)
+                if status == 416:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{file.size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    fake.count("pluginfile", 0)
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "application/pdf")
+                self.send_header("Content-Length", str(file.size - start))
+                if status == 206:
+                    self.send_header(
+                        "Content-Range", f"bytes {start}-{file.size - 1}/{file.size}"
+                    )
+                self.end_headers()
+                sent = 0
+                try:
+                    for chunk in file.chunks(start):
+                        fake.throttle(len(chunk))
+                        self.wfile.write(chunk)
+                        sent += len(chunk)
+                finally:
+                    fake.count("pluginfile", sent)
+
+            def requested_range(self, size: int) -> Tuple[int, int]:
+                header = self.headers.get("Range", "")
+                if not header.startswith("bytes=") or not header.endswith("-"):
+                    return 0, 200
+                start = int(header[len("bytes=") : -1])
+                if start >= size:
+                    return 0, 416
+                return start, 206
+
+        return Handler
+
+
+def contenthash(value: Any) -> str:
+    """Serialise the `FakeFile` in a file record as its SHA-1"""
+    if isinstance(value, FakeFile):
+        return value.contenthash
+    raise TypeError(f"cannot serialise {type(value).__name__}")
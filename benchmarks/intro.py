@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Compare rendering assignment intros with BeautifulSoup and `render_intro`
+
+Intros of the sizes seen on WeLearn, from a one line note to a few
+kilobytes of formatted instructions, are rendered both ways. The script
+checks that the outputs are identical and reports the time per intro for
+BeautifulSoup, the tag stripper alone, and the memoised `render_intro`.
+Needs beautifulsoup4, which welearn_bot itself no longer uses.
+
+    python benchmarks/intro.py [--number N]
+"""
+
+from argparse import ArgumentParser
+from timeit import timeit
+from typing import List
+
+import os
+import random
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+)
+
+from bs4 import BeautifulSoup
+from welearnbot import intro
+
+PARAGRAPH = (
+    '<p dir="ltr" style="text-align: left;">Submit your solutions as a '
+    "<strong>single PDF</strong> named <em>roll_number.pdf</em> &ndash; "
+    'late submissions lose 10&nbsp;% per day. See <a href="https://example.org'
+    '/notes?id=42&amp;page=3">the notes</a> for details.<br></p>\r\n'
+)
+LIST = (
+    "<ul>\r\n<li>Problems 1&ndash;3 from chapter 4</li>\r\n"
+    "<li>Prove that &sum; 1/n&sup2; &lt; 2</li>\r\n<li>Bonus: &quot;Zorn&#39;s"
+    " lemma&quot;</li>\r\n</ul>\r\n"
+)
+
+
+def make_intros(count: int) -> List[str]:
+    """Intros ranging from a single sentence to several kilobytes"""
+    rng = random.Random(0)
+    intros = []
+    for _ in range(count):
+        blocks = [rng.choice([PARAGRAPH, LIST]) for _ in range(rng.randint(1, 12))]
+        intros.append('<div class="no-overflow">' + "".join(blocks) + "</div>")
+    return intros
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Benchmark intro rendering")
+    parser.add_argument("--number", type=int, default=200, help="intros to render")
+    args = parser.parse_args()
+
+    intros = make_intros(args.number)
+    mismatches = [
+        markup
+        for markup in intros
+        if intro.html_to_text(markup) != BeautifulSoup(markup, "html.parser").text
+    ]
+
+    def with_bs4() -> None:
+        for markup in intros:
+            BeautifulSoup(markup, "html.parser").text
+
+    def with_stripper() -> None:
+        for markup in intros:
+            intro.html_to_text(markup)
+
+    def with_memo() -> None:
+        for markup in intros:
+            intro.render_intro(markup)
+
+    size = sum(len(markup) for markup in intros) / len(intros)
+    print(f"{len(intros)} intros, {size:.0f} characters on average")
+    for name, run in [
+        ("bs4", with_bs4),
+        ("html_to_text", with_stripper),
+        ("render_intro", with_memo),
+    ]:
+        # The first render_intro pass fills the memo, like an earlier round
+        # of the daemon or the memo saved by an earlier run would
+        seconds = min(timeit(run, number=1) for _ in range(5))
+        print(f"{name:<14} {seconds / len(intros) * 1e6:>10.1f} us per intro")
+
+    if mismatches:
+        print(f"{len(mismatches)} intros rendered differently from bs4")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Measure how much welearn_bot imports for each action
+
+Every action runs to completion under `python -X importtime` against a
+small fake Moodle site, each time in a fresh home directory, so the
+imports of its handler are measured along with those of startup. Import
+time is reported as the median over several runs, and the script fails
+if an action imports a module that it should only load on demand and
+does not need, or if import time exceeds the optional budget.
+
+    python benchmarks/startup.py [--repeat N] [--budget MS]
+"""
+
+from argparse import ArgumentParser
+from statistics import median
+from typing import Dict, List, Tuple
+
+import os
+import subprocess
+import sys
+import tempfile
+
+from e2e import SRC, write_config
+from fake_moodle import FakeMoodle
+
+# The arguments of every action
+ACTIONS = {
+    "whoami": ["whoami"],
+    "courses": ["courses"],
+    "assignments": ["assignments", "ALL"],
+    "submissions": ["submissions", "ALL"],
+    "urls": ["urls", "ALL"],
+    "files": ["files", "ALL"],
+}
+
+# Modules that must only be imported once an action actually needs them
+LAZY_MODULES = [
+    "aiohttp",
+    "bs4",
+    "google",
+    "googleapiclient",
+    "google_auth_oauthlib",
+    "welearnbot.extract",
+    "welearnbot.gcal",
+]
+
+# The lazy modules an action needs: concurrent web service calls, and
+# extracting downloaded archives
+NEEDED = {
+    "assignments": ["aiohttp", "welearnbot.extract"],
+    "submissions": ["aiohttp", "welearnbot.extract"],
+    "files": ["welearnbot.extract"],
+}
+
+
+def run(fake: FakeMoodle, courses: List[str], argv: List[str]) -> Tuple[float, Dict[str, int]]:
+    """Run the bot once, returning the total import time and every module"""
+    with tempfile.TemporaryDirectory(prefix="welearn-startup-") as home:
+        write_config(home, fake.baseurl, courses)
+        env = dict(os.environ, HOME=home, PYTHONPATH=SRC)
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-m", "welearnbot", *argv],
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+    modules = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        name = name[1:]
+        # Nested imports are indented below the module importing them
+        modules[name.rstrip()] = int(cumulative)
+    top_level = sum(
+        cumulative
+        for name, cumulative in modules.items()
+        if not name.startswith(" ")
+    )
+    return top_level / 1000, modules
+
+
+def eagerly_imported(modules: Dict[str, int]) -> List[str]:
+    """The lazy modules that were imported, or had a submodule imported"""
+    names = {name.strip() for name in modules}
+    return [
+        lazy
+        for lazy in LAZY_MODULES
+        if any(name == lazy or name.startswith(lazy + ".") for name in names)
+    ]
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Benchmark welearn_bot imports")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per action")
+    parser.add_argument(
+        "--budget", type=float, default=0, help="fail above this many ms"
+    )
+    args = parser.parse_args()
+
+    failed = False
+    fake = FakeMoodle(
+        courses=2, modules=4, participants=3, assignments=2, sizes="fixed:1K"
+    )
+    courses = [course["shortname"] for course in fake.site.courses]
+    print(f"{'action':<12} {'median ms':>10} {'max ms':>8}  unneeded imports")
+    with fake:
+        for action, argv in ACTIONS.items():
+            times = []
+            eager = set()
+            for _ in range(max(1, args.repeat)):
+                elapsed, modules = run(fake, courses, argv)
+                times.append(elapsed)
+                eager.update(eagerly_imported(modules))
+            eager -= set(NEEDED.get(action, []))
+            over_budget = args.budget and median(times) > args.budget
+            failed = failed or bool(eager) or bool(over_budget)
+            print(
+                f"{action:<12} {median(times):>10.1f} {max(times):>8.1f}  "
+                + (", ".join(sorted(eager)) or "-")
+            )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+from moodlews.scheduler import RETRY_STATUSES, RequestScheduler
+from moodlews.service import BaseClient, MoodleClient
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from time import monotonic, perf_counter
+from typing import Any, Awaitable, Callable, Iterable, List, Tuple
+
+import asyncio
+import json
+
+
+class AsyncSlots:
+    """Requests in flight on one event loop, limited like a RequestScheduler's
+
+    Slots are counted apart from the blocking requests, but share their
+    adaptive limit, so what one learns about the server applies to both.
+    """
+
+    def __init__(self, scheduler: RequestScheduler) -> None:
+        self.scheduler = scheduler
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+    async def run(
+        self,
+        send: Callable[[], Awaitable[Tuple[int, Any, bytes]]],
+        name: str,
+        idempotent: bool,
+        errors: Tuple[type, ...],
+    ) -> Tuple[Tuple[int, Any, bytes], int]:
+        """Like `RequestScheduler.run`, for an async `send` returning the
+        status, headers and body of a response, retrying on `errors`"""
+        scheduler = self.scheduler
+        attempt = 0
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(
+                    lambda: self.in_flight < scheduler.limit.slots
+                )
+                self.in_flight += 1
+            start = monotonic()
+            result = None
+            try:
+                result = await send()
+            except errors:
+                if not idempotent or attempt >= scheduler.retries:
+                    raise
+            finally:
+                ok = result is not None and result[0] not in RETRY_STATUSES
+                scheduler.limit.update(name, monotonic() - start, ok)
+                async with self.condition:
+                    self.in_flight -= 1
+                    self.condition.notify_all()
+
+            if ok or not idempotent or attempt >= scheduler.retries:
+                return result, attempt
+            retry_after = result[1].get("Retry-After") if result is not None else None
+            await asyncio.sleep(scheduler.delay(attempt, retry_after))
+            attempt += 1
+
+
+class AsyncMoodleClient(BaseClient):
+    """asyncio counterpart of `MoodleClient`
+
+    All requests share one `aiohttp` connection pool, which opens at most
+    `limit_per_host` connections to the Moodle server at any time, so many
+    web service calls can be awaited together with `asyncio.gather`.
+    """
+
+    def __init__(
+        self, baseurl, token="", limit_per_host=8, profiler=None, scheduler=None
+    ):
+        super().__init__(baseurl, token)
+        self.limit_per_host = limit_per_host
+        self.profiler = profiler
+        self.scheduler = scheduler or RequestScheduler()
+        self._session = None
+        self._slots = None
+
+    @classmethod
+    def from_client(cls, client: MoodleClient, **kwargs) -> "AsyncMoodleClient":
+        """Create an async client reusing the login and settings of a blocking client"""
+        kwargs.setdefault("profiler", client.profiler)
+        kwargs.setdefault("scheduler", client.scheduler)
+        return cls(client.baseurl, token=client.token, **kwargs)
+
+    @property
+    def session(self) -> ClientSession:
+        # The session binds to the running event loop, so create it lazily
+        if self._session is None:
+            connect_timeout, read_timeout = self.scheduler.timeout
+            connector = TCPConnector(limit_per_host=self.limit_per_host)
+            timeout = ClientTimeout(
+                sock_connect=connect_timeout, sock_read=read_timeout
+            )
+            self._session = ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    @property
+    def slots(self) -> AsyncSlots:
+        if self._slots is None:
+            self._slots = AsyncSlots(self.scheduler)
+        return self._slots
+
+    async def response(self, url, **data) -> bytes:
+        """Post to `url` and return the body, releasing the connection to the pool"""
+        form = {key: str(value) for key, value in data.items()}
+        name = self.request_name(url, data)
+
+        async def send() -> Tuple[int, Any, bytes]:
+            async with self.session.post(url, data=form) as response:
+                return response.status, response.headers, await response.read()
+
+        run = self.slots.run(
+            send, name, self.idempotent(url, data), (ClientError, asyncio.TimeoutError)
+        )
+        if self.profiler is None:
+            (_, _, body), _ = await run
+            return body
+
+        start = perf_counter()
+        try:
+            (status, _, body), retries = await run
+        except Exception as error:
+            self.profiler.record(
+                "request",
+                name,
+                start,
+                perf_counter() - start,
+                error=type(error).__name__,
+            )
+            raise
+        self.profiler.record(
+            "request",
+            name,
+            start,
+            perf_counter() - start,
+            status=status,
+            bytes=len(body),
+            retries=retries,
+        )
+        return body
+
+    async def response_json(self, url, **data):
+        return json.loads(await self.response(url, **data))
+
+    async def authenticate(self, username, password):
+        login = await self.response_json(
+            self.login_url, **self.login_data(username, password)
+        )
+        return self.read_token(login)
+
+    async def server(self, function, data={}):
+        return await self.response_json(
+            self.server_url, **self.server_data(function, data)
+        )
+
+    async def server_many(self, function, datas: Iterable[dict]) -> List[Any]:
+        """Call `function` once for each set of parameters, concurrently
+
+        Results are returned in the same order as `datas`.
+        """
+        return await asyncio.gather(*(self.server(function, data) for data in datas))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "AsyncMoodleClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
@@ -0,0 +1,139 @@
+from time import perf_counter, time
+from typing import Any, Dict, List, Tuple
+
+import json
+import math
+import os
+import threading
+
+
+class Profiler:
+    """Timings of requests, downloads and other work done during a run
+
+    Every record has a category such as "request" or "download", a name
+    such as the wsfunction, a start and a duration in `perf_counter`
+    seconds, and details like bytes, status and retries. The records are
+    summarised per name, and can be saved as a Chrome trace-event file to
+    open in chrome://tracing or Perfetto.
+
+    Clients only hold a profiler while profiling, and check for None
+    before timing anything, so there is no cost when it is off.
+    """
+
+    def __init__(self) -> None:
+        self.origin = perf_counter()
+        # Lets timestamps taken with time() in other processes be placed
+        self.wall_origin = time()
+        self.main = (os.getpid(), threading.get_ident())
+        # (category, name, start, duration, pid, thread id, details); appending
+        # to a list is atomic, so threads can record without a lock
+        self.records: List[Tuple[str, str, float, float, int, int, dict]] = []
+
+    def record(
+        self, category: str, name: str, start: float, duration: float, **details
+    ) -> None:
+        """Record work that started at `start`, a `perf_counter` time"""
+        self.records.append(
+            (
+                category,
+                name,
+                start,
+                duration,
+                os.getpid(),
+                threading.get_ident(),
+                details,
+            )
+        )
+
+    def record_wall(
+        self, category: str, name: str, start: float, end: float, pid: int, **details
+    ) -> None:
+        """Record work timed with time(), such as in a worker process"""
+        begin = self.origin + start - self.wall_origin
+        self.records.append((category, name, begin, end - start, pid, pid, details))
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Count, median, 95th percentile and total time of every name"""
+        groups: Dict[Tuple[str, str], List[tuple]] = {}
+        for record in self.records:
+            groups.setdefault(record[:2], []).append(record)
+
+        rows = []
+        for (category, name), records in sorted(groups.items()):
+            durations = sorted(record[3] for record in records)
+            rows.append(
+                {
+                    "category": category,
+                    "name": name,
+                    "count": len(durations),
+                    "p50": percentile(durations, 50),
+                    "p95": percentile(durations, 95),
+                    "total": sum(durations),
+                    "bytes": sum(record[6].get("bytes", 0) for record in records),
+                    "errors": sum(1 for record in records if failed(record[6])),
+                }
+            )
+        return rows
+
+    def format_summary(self) -> str:
+        lines = [
+            f"{'category':<10} {'name':<40} {'count':>6} {'p50 ms':>9} "
+            f"{'p95 ms':>9} {'total s':>9} {'MB':>8}"
+        ]
+        for row in self.summary():
+            lines.append(
+                f"{row['category']:<10} {row['name'][:40]:<40} {row['count']:>6} "
+                f"{row['p50'] * 1000:>9.1f} {row['p95'] * 1000:>9.1f} "
+                f"{row['total']:>9.2f} {row['bytes'] / (1 << 20):>8.2f}"
+                + (f"  {row['errors']} errors" if row["errors"] else "")
+            )
+        return "\n".join(lines)
+
+    def write_trace(self, filepath: str) -> None:
+        """Save the records as complete events of the Chrome trace format"""
+        events = []
+        threads = {}
+        for category, name, start, duration, pid, tid, details in self.records:
+            threads.setdefault((pid, tid), len(threads))
+            events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": details,
+                }
+            )
+        for (pid, tid), index in threads.items():
+            if (pid, tid) == self.main:
+                label = "main"
+            elif pid != self.main[0]:
+                label = f"process {pid}"
+            else:
+                label = f"thread {index}"
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": label},
+                }
+            )
+        with open(filepath, "w") as trace:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace)
+
+
+def failed(details: dict) -> bool:
+    return "error" in details or details.get("status", 200) >= 400
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
@@ -0,0 +1,149 @@
+from requests import exceptions
+from time import monotonic, sleep
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import random
+import threading
+
+# Statuses worth retrying: throttling, and a server or proxy that is
+# overloaded or restarting
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DEFAULT_SETTINGS = {
+    "connect_timeout": 10.0,
+    "read_timeout": 60.0,
+    "retries": 3,
+    "backoff": 0.5,
+    "max_backoff": 30.0,
+    "concurrency": 8,
+    "min_concurrency": 1,
+    "max_concurrency": 16,
+    "slowdown": 2.0,
+}
+
+
+class AdaptiveLimit:
+    """An AIMD limit on the number of requests in flight
+
+    Each successful request within `slowdown` times the usual latency of
+    its kind raises the limit by 1/limit, so it grows by about one per
+    round of requests. A failed or slow request halves it, at most once
+    per round trip, so a burst of errors does not collapse it to the
+    minimum. The usual latency is tracked separately for every kind of
+    request, since a file download and a web service call take very
+    different times.
+    """
+
+    def __init__(self, initial: float, minimum: int, maximum: int, slowdown: float):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.slowdown = slowdown
+        self.baselines: Dict[str, float] = {}
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def slots(self) -> int:
+        return int(self.limit)
+
+    def update(self, name: str, latency: float, ok: bool) -> None:
+        with self.lock:
+            baseline = self.baselines.get(name, latency)
+            # Follow faster times at once and slower ones gradually
+            if latency < baseline:
+                self.baselines[name] = latency
+            else:
+                self.baselines[name] = baseline + 0.05 * (latency - baseline)
+
+            slow = latency > self.slowdown * baseline and latency > 0.05
+            if ok and not slow:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                return
+            now = monotonic()
+            if now - self.last_decrease >= latency:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.last_decrease = now
+
+
+class RequestScheduler:
+    """Timeouts, retries and adaptive concurrency for requests to Moodle
+
+    Calls that only read data are retried after connection errors,
+    timeouts and the statuses in RETRY_STATUSES, up to `retries` times,
+    waiting a random time of up to `backoff` seconds doubled for every
+    attempt (but at most `max_backoff`, or as long as a Retry-After
+    header asks). The number of requests in flight starts at
+    `concurrency` and adapts between `min_concurrency` and
+    `max_concurrency` as an `AdaptiveLimit`.
+    """
+
+    def __init__(self, **settings) -> None:
+        settings = dict(DEFAULT_SETTINGS, **settings)
+        self.timeout = (settings["connect_timeout"], settings["read_timeout"])
+        self.retries = max(0, int(settings["retries"]))
+        self.backoff = settings["backoff"]
+        self.max_backoff = settings["max_backoff"]
+        self.limit = AdaptiveLimit(
+            settings["concurrency"],
+            int(settings["min_concurrency"]),
+            int(settings["max_concurrency"]),
+            settings["slowdown"],
+        )
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """How long to wait before retrying, with full jitter"""
+        if retry_after is not None:
+            try:
+                return min(self.max_backoff, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def acquire(self) -> None:
+        with self.condition:
+            while self.in_flight >= self.limit.slots:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, name: str, latency: float, ok: bool) -> None:
+        self.limit.update(name, latency, ok)
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def run(
+        self, send: Callable[[], Any], name: str, idempotent: bool
+    ) -> Tuple[Any, int]:
+        """Send a request with `send`, returning the response and the retries
+
+        `send` returns a `requests` response. A streamed response holds
+        its slot only until its headers arrive.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            start = monotonic()
+            try:
+                response = send()
+            except (exceptions.ConnectionError, exceptions.Timeout):
+                self.release(name, monotonic() - start, ok=False)
+                if not idempotent or attempt >= self.retries:
+                    raise
+                sleep(self.delay(attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                self.release(name, monotonic() - start, ok=False)
+                raise
+
+            failed = response.status_code in RETRY_STATUSES
+            self.release(name, monotonic() - start, ok=not failed)
+            if not failed or not idempotent or attempt >= self.retries:
+                return response, attempt
+            response.close()
+            sleep(self.delay(attempt, response.headers.get("Retry-After")))
+            attempt += 1
+
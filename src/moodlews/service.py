@@ -1,4 +1,10 @@
 from requests import Session
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+from moodlews.scheduler import RequestScheduler
+from time import perf_counter, time
+import hashlib
+import sqlite3
+import threading
 import urllib.parse
 import json
 
@@ -14,18 +20,220 @@ class ServerFunctions:
     RESOURCES = "mod_resource_get_resources_by_courses"
     COURSE_USERS = "core_enrol_get_enrolled_users"
     SUBMISSION = "mod_assign_get_submission_status"
+    SUBMISSIONS = "mod_assign_get_submissions"
+    COURSE_UPDATES = "core_course_get_updates_since"
 
 
-class MoodleClient:
-    def __init__(self, baseurl):
+class ResponseCache:
+    """Persistent cache of web service responses, stored in an SQLite file
+
+    Entries are keyed by the user, the wsfunction and its normalised
+    parameters, and expire after a per-function TTL in seconds. Functions
+    without a TTL are never cached. Once more than `max_entries` entries
+    are stored, the least recently used ones are evicted.
+    """
+
+    DEFAULT_TTLS = {
+        ServerFunctions.SITE_INFO: 24 * 3600,
+        ServerFunctions.USER_COURSES: 3600,
+        ServerFunctions.ALL_COURSES: 3600,
+        ServerFunctions.COURSE_CONTENTS: 300,
+    }
+
+    def __init__(self, path, ttls=None, max_entries=1000):
+        self.ttls = dict(self.DEFAULT_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    user TEXT NOT NULL,
+                    function TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    stored REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )"""
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+            )
+
+    @staticmethod
+    def user_key(baseurl, token):
+        """Identify a user without storing their token in the cache"""
+        return hashlib.sha256(f"{baseurl} {token}".encode()).hexdigest()[:32]
+
+    @staticmethod
+    def key(user, function, data):
+        params = json.dumps(
+            sorted((str(name), str(value)) for name, value in data.items())
+        )
+        return hashlib.sha256(f"{user} {function} {params}".encode()).hexdigest()
+
+    def cacheable(self, function):
+        return self.ttls.get(function, 0) > 0
+
+    def get(self, user, function, data):
+        """Return the cached response, or None if it is missing or expired"""
+        key = self.key(user, function, data)
+        now = time()
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT body, stored FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttls[function]:
+                self.misses += 1
+                return None
+            self.connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, user, function, data, response):
+        key = self.key(user, function, data)
+        now = time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, user, function, json.dumps(response), now, now),
+            )
+            self.connection.execute(
+                """DELETE FROM responses WHERE key NOT IN (
+                    SELECT key FROM responses ORDER BY accessed DESC LIMIT ?
+                )""",
+                (self.max_entries,),
+            )
+
+    def invalidate(self, user, function=None):
+        """Drop the entries of one user, touching nobody else's"""
+        with self.lock, self.connection:
+            if function is None:
+                self.connection.execute("DELETE FROM responses WHERE user = ?", (user,))
+            else:
+                self.connection.execute(
+                    "DELETE FROM responses WHERE user = ? AND function = ?",
+                    (user, function),
+                )
+
+    def close(self):
+        self.connection.close()
+
+
+class BaseClient:
+    """Request building shared by the blocking and asyncio clients"""
+
+    def __init__(self, baseurl, token=""):
         self.baseurl = baseurl
         self.login_url = urllib.parse.urljoin(baseurl, "login/token.php")
         self.server_url = urllib.parse.urljoin(baseurl, "webservice/rest/server.php")
+        self.token = token
+
+    def login_data(self, username, password):
+        return {
+            "username": username,
+            "password": password,
+            "service": "moodle_mobile_app",
+        }
+
+    def server_data(self, function, data):
+        return dict(
+            wstoken=self.token, moodlewsrestformat="json", wsfunction=function, **data
+        )
+
+    def request_name(self, url, data):
+        """What a request is for: its wsfunction, a login or a file download"""
+        if "wsfunction" in data:
+            return data["wsfunction"]
+        if url == self.login_url:
+            return "login"
+        if "/pluginfile.php/" in url:
+            return "pluginfile"
+        return urllib.parse.urlsplit(url).path
+
+    def idempotent(self, url, data):
+        """Whether a request only reads, so that it is safe to send again"""
+        function = data.get("wsfunction")
+        return function is None or "_get_" in function
+
+    def read_token(self, login):
+        try:
+            self.token = login["token"]
+            return self.token
+        except KeyError:
+            return False
+
+
+class MoodleClient(BaseClient):
+    def __init__(self, baseurl, pool_size=DEFAULT_POOLSIZE, scheduler=None):
+        super().__init__(baseurl)
+        # Timeouts, retries and adaptive concurrency for every request
+        self.scheduler = scheduler or RequestScheduler()
         self.session = Session()
-        self.token = ""
+        # Keep enough pooled connections for parallel callers sharing the session
+        adapter = HTTPAdapter(pool_maxsize=max(pool_size, DEFAULT_POOLSIZE))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Optional ResponseCache, and whether to skip reading from it
+        self.cache = None
+        self.bypass_cache = False
+        # Responses already fetched in this session, and calls still in flight
+        self.memo = {}
+        self.in_flight = {}
+        self.memo_lock = threading.Lock()
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.coalesced = 0
+        # Called to log in again when the server rejects the token, returning
+        # the new token
+        self.reauthenticate = None
+        self.reauth_lock = threading.Lock()
+        self.reauth_count = 0
+        # Optional Profiler timing every request
+        self.profiler = None
+
+    def response(self, url, stream=False, headers=None, **data):
+        # With stream=True the body is only read as the caller iterates over it
+        name = self.request_name(url, data)
+
+        def send():
+            return self.session.post(
+                url,
+                data,
+                stream=stream,
+                headers=headers,
+                timeout=self.scheduler.timeout,
+            )
 
-    def response(self, url, **data):
-        return self.session.post(url, data)
+        idempotent = self.idempotent(url, data)
+        if self.profiler is None:
+            return self.scheduler.run(send, name, idempotent)[0]
+
+        start = perf_counter()
+        try:
+            response, retries = self.scheduler.run(send, name, idempotent)
+        except Exception as error:
+            self.profiler.record(
+                "request",
+                name,
+                start,
+                perf_counter() - start,
+                error=type(error).__name__,
+            )
+            raise
+        details = {"status": response.status_code, "retries": retries}
+        if not stream:
+            details["bytes"] = len(response.content)
+        elif response.headers.get("Content-Length", "").isdigit():
+            # Streamed bodies are still to come, so count their announced
+            # size, and leave out the size of chunked ones rather than read them
+            details["bytes"] = int(response.headers["Content-Length"])
+        self.profiler.record("request", name, start, perf_counter() - start, **details)
+        return response
 
     def response_json(self, url, **data):
         response = self.response(url, **data)
@@ -33,25 +241,108 @@ class MoodleClient:
 
     def authenticate(self, username, password):
         login = self.response_json(
-            self.login_url,
-            username=username,
-            password=password,
-            service="moodle_mobile_app",
+            self.login_url, **self.login_data(username, password)
         )
+        return self.read_token(login)
+
+    def server(self, function, data={}, fresh=False):
+        """Call a web service function, reusing identical calls from this session
+
+        Concurrent callers asking for the same call wait for a single
+        request instead of sending their own. The same response object is
+        returned to every caller, so it must not be modified. With
+        fresh=True, no memoised or cached response is used.
+        """
+        params = sorted((str(name), str(value)) for name, value in data.items())
+        key = (function, json.dumps(params))
+        with self.memo_lock:
+            if fresh:
+                self.memo.pop(key, None)
+            if key in self.memo:
+                self.memo_hits += 1
+                return self.memo[key]
+            event = self.in_flight.get(key)
+            if event is None:
+                event = self.in_flight[key] = threading.Event()
+                self.memo_misses += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            event.wait()
+            with self.memo_lock:
+                if key in self.memo:
+                    return self.memo[key]
+            # The request we waited for failed, so make our own
+            return self.fetch(function, data, fresh)
+
         try:
-            self.token = login["token"]
-            return self.token
-        except KeyError:
-            return False
+            response = self.fetch(function, data, fresh)
+            if not (isinstance(response, dict) and "exception" in response):
+                with self.memo_lock:
+                    self.memo[key] = response
+            return response
+        finally:
+            with self.memo_lock:
+                del self.in_flight[key]
+            event.set()
+
+    def clear_memo(self):
+        with self.memo_lock:
+            self.memo.clear()
+
+    def clear_cache(self):
+        """Drop the responses cached on disk for the current token"""
+        if self.cache is not None:
+            self.cache.invalidate(ResponseCache.user_key(self.baseurl, self.token))
 
-    def server(self, function, data={}):
-        return self.response_json(
-            self.server_url,
-            wstoken=self.token,
-            moodlewsrestformat="json",
-            wsfunction=function,
-            **data
+    def call(self, function, data):
+        """Call a web service function, logging in again if the token expired"""
+        token = self.token
+        response = self.response_json(
+            self.server_url, **self.server_data(function, data)
         )
+        if not self.invalid_token(response) or self.reauthenticate is None:
+            return response
+
+        self.refresh_token(token)
+        return self.response_json(self.server_url, **self.server_data(function, data))
+
+    def refresh_token(self, token):
+        """Log in again after `token` was rejected"""
+        with self.reauth_lock:
+            # Another caller may have logged in again already
+            if self.token == token:
+                self.token = self.reauthenticate()
+                self.reauth_count += 1
+                # Responses cached for the rejected token can never be used
+                if self.cache is not None:
+                    self.cache.invalidate(ResponseCache.user_key(self.baseurl, token))
+
+    @staticmethod
+    def invalid_token(response):
+        if not isinstance(response, dict):
+            return False
+        return response.get("errorcode") == "invalidtoken"
+
+    def fetch(self, function, data, fresh=False):
+        if self.cache is None or not self.cache.cacheable(function):
+            return self.call(function, data)
+
+        user = ResponseCache.user_key(self.baseurl, self.token)
+        if not self.bypass_cache and not fresh:
+            cached = self.cache.get(user, function, data)
+            if cached is not None:
+                return cached
+        response = self.call(function, data)
+        # Never cache Moodle errors
+        if not (isinstance(response, dict) and "exception" in response):
+            self.cache.put(user, function, data, response)
+        return response
 
     def close(self):
         self.session.close()
+        if self.cache is not None:
+            self.cache.close()
@@ -3,17 +3,19 @@ from configparser import RawConfigParser
 import os
 from time import time
 from typing import List
-from bs4 import BeautifulSoup as bs
 from datetime import datetime
 
 from moodlews.service import MoodleClient, ServerFunctions
 from welearnbot import resolvers, utils
-from welearnbot.constants import COURSE_CACHE
-from welearnbot.gcal import publish_gcal_event
+from welearnbot.constants import COURSE_CACHE, SUBMISSION_CACHE
+from welearnbot.downloader import DownloadPool
+from welearnbot.intro import render_intro
+from welearnbot.linkcache import LinkCache
 
 
 def handle_whoami(moodle: MoodleClient) -> None:
     info = moodle.server(ServerFunctions.SITE_INFO)
+    utils.records.emit("user", userid=info["userid"], fullname=info["fullname"])
     print(info["fullname"])
 
 
@@ -29,6 +31,13 @@ def handle_courses(moodle: MoodleClient) -> None:
         star = " "
         if course["isfavourite"]:
             star = "*"
+        utils.records.emit(
+            "course",
+            id=course["id"],
+            shortname=course["shortname"],
+            fullname=course_name,
+            favourite=bool(course["isfavourite"]),
+        )
         print(f" {star} {course_name}")
 
 
@@ -40,12 +49,37 @@ def handle_assignments(
     prefix_path: str,
     link_cache_filepath: str,
     token: str,
-) -> None:
-    link_cache = utils.read_cache(link_cache_filepath)
+) -> utils.FileStatuses:
+    link_cache = LinkCache(link_cache_filepath)
     # Get assignment data from server
     assignments = moodle.server(ServerFunctions.ASSIGNMENTS)
 
-    file_statuses = []
+    # Request the submission status of every listed assignment up front,
+    # with a bounded number of requests in flight
+    listed_ids = [
+        assignment["id"]
+        for course in assignments["courses"]
+        if course["shortname"] in args.courses
+        for assignment in course["assignments"]
+        if not args.dueassignments or int(assignment["duedate"]) > time()
+    ]
+    statuses = utils.server_many(
+        moodle,
+        ServerFunctions.ASSIGNMENT_STATUS,
+        [{"assignid": assignment_id} for assignment_id in listed_ids],
+        args.concurrency,
+    )
+    submissions = dict(zip(listed_ids, statuses))
+
+    calendar = None
+    if args.gcalendar:
+        # The Google client libraries are slow to import, so only load them
+        # when the calendar is actually used
+        from welearnbot.gcal import CalendarSync
+
+        calendar = CalendarSync(config)
+
+    pool = DownloadPool.from_args(args)
     # Assignments are grouped by course
     for course in assignments["courses"]:
         course_name = course["shortname"]
@@ -66,39 +100,41 @@ def handle_assignments(
                 continue
             no_assignments = False
             if not no_assignments:
-                print(course_name)
+                utils.log(course_name)
             # Show assignment details
             duedelta_str = (
                 f"{abs(duedelta.days)} days, {duedelta.seconds // 3600} hours"
             )
-            detail = bs(assignment["intro"], "html.parser").text
-            print(f"    {name} - {detail}")
+            detail = render_intro(assignment["intro"])
+            utils.log(f"    {name} - {detail}")
             for attachment in assignment["introattachments"]:
-                print(f"        Attachment     : {attachment['filename']}")
-                file_statuses.append(
-                    utils.download_resource(
-                        args,
-                        moodle,
-                        ignore_types,
-                        attachment,
-                        prefix_path,
-                        course_name,
-                        link_cache,
-                        token,
-                        indent=8,
-                    )
+                utils.log(f"        Attachment     : {attachment['filename']}")
+                pool.submit(
+                    args,
+                    moodle,
+                    ignore_types,
+                    attachment,
+                    prefix_path,
+                    course_name,
+                    link_cache,
+                    token,
+                    indent=8,
+                    due=int(assignment["duedate"]),
                 )
             if due:
-                print(f"        Due on         : {due_str}")
-                print(f"        Time remaining : {duedelta_str}")
+                utils.log(f"        Due on         : {due_str}")
+                utils.log(f"        Time remaining : {duedelta_str}")
             else:
-                print(f"        Due on         : {due_str} ({duedelta_str} ago)")
+                utils.log(f"        Due on         : {due_str} ({duedelta_str} ago)")
 
-            # Get submission details
-            submission = moodle.server(
-                ServerFunctions.ASSIGNMENT_STATUS, {"assignid": assignment_id}
-            )
+            # Get submission details, fetching any that became due since the prefetch
+            submission = submissions.get(assignment_id)
+            if submission is None:
+                submission = moodle.server(
+                    ServerFunctions.ASSIGNMENT_STATUS, {"assignid": assignment_id}
+                )
             submission_made = False
+            submitted = []
             try:
                 for plugin in submission["lastattempt"]["submission"]["plugins"]:
                     if plugin["name"] == "File submissions":
@@ -107,29 +143,58 @@ def handle_assignments(
                                 for submitted_file in filearea["files"]:
                                     submission_made = True
                                     filename = submitted_file["filename"]
+                                    submitted.append(
+                                        {
+                                            "filename": filename,
+                                            "timemodified": int(
+                                                submitted_file["timemodified"]
+                                            ),
+                                        }
+                                    )
                                     submission_date = datetime.fromtimestamp(
                                         int(submitted_file["timemodified"])
                                     )
                                     submission_date_str = submission_date.strftime(
                                         "%a %d %b, %Y, %H:%M:%S"
                                     )
-                                    print(
+                                    utils.log(
                                         f"        Submission     : {filename} ({submission_date_str})"
                                     )
             except KeyError:
                 continue
+            finally:
+                # Reported even when there is no attempt to show
+                utils.records.emit(
+                    "assignment",
+                    course=course_name,
+                    id=assignment_id,
+                    name=name,
+                    intro=detail,
+                    duedate=int(assignment["duedate"]),
+                    due=due,
+                    attachments=[
+                        attachment["filename"]
+                        for attachment in assignment["introattachments"]
+                    ],
+                    submissions=submitted,
+                )
             if not submission_made:
-                print(f"        Submission     : NONE")
+                utils.log(f"        Submission     : NONE")
 
-            # Write event to calendar
-            if args.gcalendar and due:
-                publish_gcal_event(
-                    config, duedate, course_name, name, assignment_id, detail
-                )
-            print()
+            # Queue event for the calendar
+            if calendar is not None and due:
+                calendar.add(duedate, course_name, name, assignment_id, detail)
+            utils.log()
 
-    utils.write_cache(link_cache_filepath, link_cache)
+    # Send all calendar changes together
+    if calendar is not None:
+        calendar.flush()
+
+    pool.close()
+    file_statuses = pool.results()
+    link_cache.close()
     utils.show_file_statuses(file_statuses, verbose=args.verbose)
+    return file_statuses
 
 
 def handle_submissions(
@@ -140,21 +205,31 @@ def handle_submissions(
     prefix_path: str,
     link_cache_filepath: str,
     token: str,
-) -> None:
+) -> utils.FileStatuses:
     userid = resolvers.get_userid(moodle)
 
     submission_config = resolvers.resolve_submission_details(config)
 
     course_cache_filepath = os.path.join(prefix_path, COURSE_CACHE)
     courses_cache = utils.get_courses_cache(
-        moodle, course_cache_filepath, userid, args.update_course_cache,
+        moodle,
+        course_cache_filepath,
+        userid,
+        args.update_course_cache,
+        resolvers.resolve_course_cache_max_age(config) * 24 * 3600,
+        args.concurrency,
     )
 
-    link_cache = utils.read_cache(link_cache_filepath)
-    file_statuses = []
+    submission_cache_filepath = os.path.join(prefix_path, SUBMISSION_CACHE)
+    submission_cache = utils.read_cache(submission_cache_filepath)
+    synced_courses = []
+    sync_time = int(time())
+
+    link_cache = LinkCache(link_cache_filepath)
+    pool = DownloadPool.from_args(args)
     for course in args.courses:
         if course not in courses_cache:
-            print(f"{course} is not a valid course id")
+            utils.log(f"{course} is not a valid course id")
             continue
         if args.rolls:
             rolls = utils.get_rolls(",".join(args.rolls))
@@ -162,47 +237,82 @@ def handle_submissions(
             try:
                 rolls = submission_config[course]
             except KeyError:
-                print(
+                utils.log(
                     f'Could not resolve roll numbers for {course}. Please add it in your config or use "-r" flag'
                 )
                 continue
         if "ALL" in rolls:
             rolls = sorted(courses_cache[course]["participants"].keys())
 
+        participants = courses_cache[course]["participants"]
+        roll_by_userid = {
+            participants[roll]["id"]: roll for roll in rolls if roll in participants
+        }
+
+        # Only ask for submissions modified since every requested roll was last synced
+        synced = submission_cache.setdefault(course, {})
+        since = 0
+        if not args.forcedownload and not args.missingdownload:
+            since = min(
+                (synced.get(roll, 0) for roll in roll_by_userid.values()), default=0
+            )
+        if since:
+            # Submissions older than `since` are not listed again, so keep
+            # them from being pruned
+            link_cache.touch_course(course)
+
         assignments = utils.fetch_assignments(moodle, courses_cache[course]["id"])
-        for assignment in assignments:
-            if assignment["duedate"] > time():
-                continue
-            for roll in rolls:
-                submission_data = moodle.server(
-                    ServerFunctions.SUBMISSION,
-                    {
-                        "assignid": assignment["id"],
-                        "userid": courses_cache[course]["participants"][roll]["id"],
-                    },
-                )
-                try:
-                    file_data = submission_data["lastattempt"]["submission"]["plugins"][
-                        0
-                    ]["fileareas"][0]["files"]
-                except KeyError:
+        past_due = {
+            assignment["id"]: assignment
+            for assignment in assignments
+            if assignment["duedate"] <= time()
+        }
+        # Assignments that fell due after the last sync were not asked for
+        # then, so all of their submissions are fetched, however old
+        submissions = utils.fetch_submissions(
+            moodle, [i for i, a in past_due.items() if a["duedate"] <= since], since
+        )
+        submissions.update(
+            utils.fetch_submissions(
+                moodle, [i for i, a in past_due.items() if a["duedate"] > since]
+            )
+        )
+        for assignment_id, assignment_submissions in submissions.items():
+            assignment = past_due[assignment_id]
+            for submission in assignment_submissions:
+                roll = roll_by_userid.get(submission["userid"])
+                if roll is None:
                     continue
-                if file_data:
-                    file_statuses.append(
-                        utils.download_resource(
-                            args,
-                            moodle,
-                            ignore_types,
-                            file_data[0],
-                            prefix_path,
-                            course,
-                            link_cache,
-                            token,
-                            ["submissions", assignment["name"], roll],
-                        )
+                for submitted_file in utils.submission_files(submission):
+                    filearea_path = submitted_file.get("filepath", "/").strip("/")
+                    subfolders = ["submissions", assignment["name"], roll]
+                    subfolders += filearea_path.split("/")
+                    pool.submit(
+                        args,
+                        moodle,
+                        ignore_types,
+                        submitted_file,
+                        prefix_path,
+                        course,
+                        link_cache,
+                        token,
+                        [subfolder for subfolder in subfolders if subfolder],
+                        group=(course, roll),
                     )
-    utils.write_cache(link_cache_filepath, link_cache)
+        synced_courses.append((course, synced, list(roll_by_userid.values())))
+    pool.close()
+    file_statuses = pool.results()
+    link_cache.close()
+
+    # Record the sync time only once every download has gone through, and
+    # not for rolls with a failed download, so that it is tried again
+    for course, synced, synced_rolls in synced_courses:
+        for roll in synced_rolls:
+            if (course, roll) not in pool.failed:
+                synced[roll] = sync_time
+    utils.write_cache(submission_cache_filepath, submission_cache)
     utils.show_file_statuses(file_statuses, verbose=args.verbose)
+    return file_statuses
 
 
 def handle_urls(args: Namespace, moodle: MoodleClient) -> None:
@@ -230,8 +340,16 @@ def handle_urls(args: Namespace, moodle: MoodleClient) -> None:
                 print(course_name)
             no_url = False
             url_name = url["name"]
-            url_detail = bs(url["intro"], "html.parser").text
+            url_detail = render_intro(url["intro"])
             url_link = url["externalurl"]
+            utils.records.emit(
+                "url",
+                course=course_name,
+                id=url["id"],
+                name=url_name,
+                intro=url_detail,
+                url=url_link,
+            )
             print(f"    {url_name} - {url_detail}")
             print(f"        Link : {url_link}")
             print()
@@ -246,50 +364,102 @@ def handle_files(
     prefix_path: str,
     link_cache_filepath: str,
     token: str,
-) -> None:
-    link_cache = utils.read_cache(link_cache_filepath)
+) -> utils.FileStatuses:
+    link_cache = LinkCache(link_cache_filepath)
     course_ids = resolvers.get_courses_by_id(moodle, args)
+    sync_time = int(time())
+    ignored = ",".join(sorted(ignore_types))
+
+    # Ask which modules changed in courses synced before, all at once. A
+    # course synced with other ignored types is walked in full instead
+    incremental = []
+    if not args.forcedownload and not args.missingdownload:
+        incremental = [
+            (courseid, link_cache.last_sync(courseid, ignored))
+            for courseid in course_ids
+            if link_cache.last_sync(courseid, ignored)
+        ]
+    updates = utils.server_many(
+        moodle,
+        ServerFunctions.COURSE_UPDATES,
+        [{"courseid": courseid, "since": since} for courseid, since in incremental],
+        args.concurrency,
+    )
+    changed_modules = {
+        courseid: utils.updated_modules(course_updates)
+        for (courseid, _), course_updates in zip(incremental, updates)
+    }
 
-    file_statuses = []
+    pool = DownloadPool.from_args(args)
 
     # Iterate through each course, and fetch all modules
     for courseid in course_ids:
         course_name = course_ids[courseid]
-        page = moodle.server(ServerFunctions.COURSE_CONTENTS, {"courseid": courseid})
+        # None means the whole course has to be walked
+        changed = changed_modules.get(courseid)
+        if changed is not None:
+            # Files of the modules that are not walked are still there, so
+            # keep them from being pruned
+            link_cache.touch_course(course_name)
+            if not changed:
+                continue
+        # A cached listing could miss changes made before the sync time
+        page = moodle.server(
+            ServerFunctions.COURSE_CONTENTS, {"courseid": courseid}, fresh=True
+        )
         for item in page:
             modules = item.get("modules", [])
             for module in modules:
+                if changed is not None and module.get("id") not in changed:
+                    continue
                 modname = module.get("modname", "")
                 if modname == "resource":
                     for resource in module["contents"]:
-                        file_statuses.append(
-                            utils.download_resource(
-                                args,
-                                moodle,
-                                ignore_types,
-                                resource,
-                                prefix_path,
-                                course_name,
-                                link_cache,
-                                token,
-                            )
+                        pool.submit(
+                            args,
+                            moodle,
+                            ignore_types,
+                            resource,
+                            prefix_path,
+                            course_name,
+                            link_cache,
+                            token,
+                            group=courseid,
                         )
                 elif modname == "folder":
                     folder_name = module.get("name", "")
                     for resource in module["contents"]:
-                        file_statuses.append(
-                            utils.download_resource(
-                                args,
-                                moodle,
-                                ignore_types,
-                                resource,
-                                prefix_path,
-                                course_name,
-                                link_cache,
-                                token,
-                                subfolders=[folder_name],
-                            )
+                        pool.submit(
+                            args,
+                            moodle,
+                            ignore_types,
+                            resource,
+                            prefix_path,
+                            course_name,
+                            link_cache,
+                            token,
+                            subfolders=[folder_name],
+                            group=courseid,
                         )
 
-    utils.write_cache(link_cache_filepath, link_cache)
+    pool.close()
+    file_statuses = pool.results()
+    # Later runs only need newer changes of courses where every download
+    # went through; a course with a failed download is walked again
+    for courseid in course_ids:
+        if courseid not in pool.failed:
+            link_cache.record_sync(courseid, sync_time, ignored)
+    link_cache.close()
     utils.show_file_statuses(file_statuses, verbose=args.verbose)
+    return file_statuses
+
+
+def handle_prune(config: RawConfigParser, link_cache_filepath: str) -> None:
+    link_cache = LinkCache(link_cache_filepath)
+    max_age = resolvers.resolve_link_cache_max_age(config)
+    removed = link_cache.compact(max_age * 24 * 3600)
+    utils.records.emit("prune", removed=removed, remaining=len(link_cache))
+    print(
+        f"Removed {removed} stale link cache entries, {len(link_cache)} remaining"
+    )
+    link_cache.close()
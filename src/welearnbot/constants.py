@@ -1,7 +1,25 @@
 BASEURL = "https://welearn.iiserkol.ac.in"
-LINK_CACHE = ".link_cache"
+LINK_CACHE = ".link_cache.db"
+LEGACY_LINK_CACHE = ".link_cache"
+LINK_CACHE_MAX_AGE = 180
+COURSE_CACHE_MAX_AGE = 7
+DAEMON_INTERVALS = {
+    "min_interval": 300,
+    "max_interval": 6 * 3600,
+    "due_window": 24 * 3600,
+}
 COURSE_CACHE = ".course_cache"
+SUBMISSION_CACHE = ".submission_cache"
+RESPONSE_CACHE = ".response_cache"
+INTRO_CACHE = ".intro_cache"
+OBJECT_STORE = ".objects"
 EVENT_CACHE = "~/.welearn_event_cache"
+EVENT_SYNC_CACHE = "~/.welearn_event_sync"
+TOKEN_CACHE = "~/.welearn_token"
+DEFAULT_JOBS = 4
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_CONCURRENCY = 8
+DOWNLOAD_ORDER = ["due", "size", "course"]
 ARCHIVE_TYPES = [
     "7Z",
     "GZ",
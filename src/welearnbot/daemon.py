@@ -0,0 +1,146 @@
+from moodlews.service import MoodleClient, ServerFunctions
+from welearnbot import resolvers
+from welearnbot.utils import log, records
+from welearnbot.welearnbot import resolve_settings, run_action
+
+from argparse import ArgumentParser, Namespace
+from configparser import RawConfigParser
+from copy import copy
+from time import time
+from typing import Dict, List, Set, Tuple
+
+import shlex
+import signal
+import threading
+import traceback
+
+# Schedule key for actions that do not work on courses, such as `whoami`
+NO_COURSE = ""
+
+
+class Daemon:
+    """Keep running the actions from the [daemon] section with one session
+
+    Every course of every action is polled on its own schedule. A course
+    in which nothing was downloaded has its interval doubled, up to
+    `max_interval`, while activity or an assignment due within
+    `due_window` brings it back to `min_interval`. Sending SIGUSR1 syncs
+    everything straight away, and SIGINT or SIGTERM stop the daemon.
+    """
+
+    def __init__(
+        self, parser: ArgumentParser, config: RawConfigParser, moodle: MoodleClient
+    ) -> None:
+        self.config = config
+        self.moodle = moodle
+        lines, settings = resolvers.resolve_daemon_settings(config)
+        self.min_interval = settings["min_interval"]
+        self.max_interval = max(settings["max_interval"], self.min_interval)
+        self.due_window = settings["due_window"]
+
+        self.jobs: List[Tuple[str, Namespace]] = []
+        for line in lines:
+            args = parser.parse_args(shlex.split(line))
+            action = resolvers.resolve_action_mode(args)
+            if action in ("daemon", "prune"):
+                continue
+            resolve_settings(config, args)
+            resolvers.expand_all_courses(config, args, action)
+            self.jobs.append((action, args))
+        # Every action downloads on its own, so fetch the attachments of due
+        # assignments before the files of other actions in every round
+        self.jobs.sort(key=lambda job: job[0] != "assignments")
+
+        # (job index, course) -> [interval, time of next run]
+        self.schedule: Dict[Tuple[int, str], List[float]] = {}
+        for index, (_, args) in enumerate(self.jobs):
+            for course in args.courses or [NO_COURSE]:
+                self.schedule[index, course] = [self.min_interval, 0.0]
+
+        self.wake = threading.Event()
+        self.stopping = False
+
+    def install_signals(self) -> None:
+        def trigger(signum, frame) -> None:
+            self.sync_now()
+
+        def stop(signum, frame) -> None:
+            self.stopping = True
+            self.wake.set()
+
+        # SIGUSR1 is not available on Windows
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, trigger)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+    def sync_now(self) -> None:
+        """Run every action for every course at the next opportunity"""
+        for entry in self.schedule.values():
+            entry[1] = 0.0
+        self.wake.set()
+
+    def courses_due_soon(self) -> Set[str]:
+        """Courses with an assignment due within the due window"""
+        now = time()
+        try:
+            assignments = self.moodle.server(ServerFunctions.ASSIGNMENTS)
+            return {
+                course["shortname"]
+                for course in assignments["courses"]
+                for assignment in course["assignments"]
+                if 0 < int(assignment["duedate"]) - now <= self.due_window
+            }
+        except Exception:
+            return set()
+
+    def run(self) -> None:
+        self.install_signals()
+        log(f"Running {len(self.jobs)} actions, send SIGUSR1 to sync now")
+        while not self.stopping:
+            # Fresh data for every round
+            self.moodle.clear_memo()
+            self.wake.clear()
+            due_soon = self.courses_due_soon()
+            for index, (action, args) in enumerate(self.jobs):
+                if self.stopping:
+                    break
+                self.run_job(index, action, args, due_soon)
+
+            if self.stopping:
+                break
+            next_run = min(entry[1] for entry in self.schedule.values())
+            self.wake.wait(timeout=max(0.0, next_run - time()))
+
+    def run_job(
+        self, index: int, action: str, args: Namespace, due_soon: Set[str]
+    ) -> None:
+        now = time()
+        courses = [
+            course
+            for course in args.courses or [NO_COURSE]
+            if self.schedule[index, course][1] <= now
+        ]
+        if not courses:
+            return
+
+        job_args = copy(args)
+        job_args.courses = [course for course in courses if course != NO_COURSE]
+        try:
+            file_statuses = run_action(action, job_args, self.config, self.moodle)
+        except Exception:
+            log(f"{action} failed:\n{traceback.format_exc()}")
+            file_statuses = None
+        # Consumers of the records should not wait for the next round
+        records.flush()
+
+        # Courses in which something was downloaded are polled more often
+        active = file_statuses.downloaded_courses if file_statuses else set()
+        finished = time()
+        for course in courses:
+            entry = self.schedule[index, course]
+            if course in active or course in due_soon:
+                entry[0] = self.min_interval
+            else:
+                entry[0] = min(entry[0] * 2, self.max_interval)
+            entry[1] = finished + entry[0]
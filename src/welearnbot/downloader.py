@@ -0,0 +1,188 @@
+from welearnbot import utils
+from welearnbot.mirrorindex import MirrorIndex
+
+from argparse import Namespace
+from inspect import signature
+from itertools import count
+from queue import PriorityQueue
+from time import monotonic, sleep, time
+from typing import TYPE_CHECKING, Any, List, Optional, Sequence, Set
+
+import math
+import threading
+
+if TYPE_CHECKING:
+    from welearnbot.extract import ExtractionPool
+
+DOWNLOAD_PARAMETERS = signature(utils.download_resource)
+
+
+class TokenBucket:
+    """A limit on the bytes per second read by all download workers
+
+    Workers take tokens for every chunk they receive, and the bucket
+    refills at `rate` tokens per second up to `burst`. A worker that takes
+    more than there are goes into debt and sleeps until it is paid off, so
+    the total rate stays at `rate` however many workers share the bucket.
+    """
+
+    def __init__(self, rate: int, burst: Optional[int] = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = float(self.burst)
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            sleep(wait)
+
+
+class DownloadPool:
+    """Run `utils.download_resource` jobs on a pool of worker threads
+
+    Jobs may be submitted from any handler, and are started in the
+    priority given by `order`, a list of "due" (attachments of the
+    assignments due soonest), "size" (smallest files) and "course"
+    (alphabetically), with ties in submission order. With an `order`, no
+    download starts before `start` or `close` is called, so all the jobs
+    of the pool are ordered, not just the ones left waiting for a worker.
+    Without one, downloads start as soon as they are submitted. The order
+    only holds within a pool, and every action has a pool of its own.
+
+    The statuses of the jobs are added up in a `utils.FileStatuses` for
+    `show_file_statuses`, keeping the names of ignored and missing files
+    only with `keep_names`. Jobs may name a `group`, such as their course,
+    and the groups with a failed download are collected in `failed`.
+
+    With a `bandwidth` in bytes per second, all workers together download
+    no faster than that. The workers share a `MirrorIndex` of the files
+    already on disk. Downloaded archives are extracted by a separate
+    `ExtractionPool` unless `extract` is False.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        extract: bool = True,
+        prune_extracted: bool = False,
+        order: Sequence[str] = (),
+        bandwidth: int = 0,
+        keep_names: bool = False,
+    ) -> None:
+        self.order = list(order)
+        self.bandwidth = TokenBucket(bandwidth) if bandwidth > 0 else None
+        self.index = MirrorIndex()
+        self.extractor: Optional["ExtractionPool"] = None
+        if extract:
+            from welearnbot.extract import ExtractionPool
+
+            self.extractor = ExtractionPool(prune=prune_extracted)
+        self.statuses = utils.FileStatuses(keep_names)
+        self.failed: Set[Any] = set()
+        # The first error raised by a job, raised again by `results`
+        self.error: Optional[BaseException] = None
+        self.queue: PriorityQueue = PriorityQueue()
+        self.sequence = count()
+        self.workers = [
+            threading.Thread(target=self.work, daemon=True)
+            for _ in range(max(1, workers))
+        ]
+        self.started = False
+        if not self.order:
+            self.start()
+
+    @classmethod
+    def from_args(cls, args: Namespace) -> "DownloadPool":
+        """Create a pool using the download settings resolved in `main`"""
+        return cls(
+            args.jobs,
+            args.extract,
+            args.prune_extracted,
+            args.download_order,
+            args.bandwidth,
+            # Machine readable output reports every file as it goes
+            keep_names=args.verbose and not utils.records.enabled,
+        )
+
+    def priority(self, resource: Any, course: str, due: Optional[float]) -> tuple:
+        """Sort key of a job, lowest first"""
+        key: List[Any] = []
+        for criterion in self.order:
+            if criterion == "due":
+                key.append(due if due is not None and due > time() else math.inf)
+            elif criterion == "size":
+                key.append(resource.get("filesize") or math.inf)
+            elif criterion == "course":
+                key.append(course)
+        return tuple(key)
+
+    def submit(
+        self, *args, due: Optional[float] = None, group: Any = None, **kwargs
+    ) -> None:
+        """Queue a download, taking the same arguments as `download_resource`
+
+        `due` is the due date of the assignment the file belongs to, if any.
+        """
+        kwargs.setdefault("extractor", self.extractor)
+        kwargs.setdefault("bandwidth", self.bandwidth)
+        kwargs.setdefault("index", self.index)
+        job = DOWNLOAD_PARAMETERS.bind(*args, **kwargs).arguments
+        key = self.priority(job["resource"], job["course"], due)
+        # The sequence number breaks ties, so jobs themselves are never compared
+        self.queue.put((0, key, next(self.sequence), group, args, kwargs))
+
+    def start(self) -> None:
+        """Start downloading the queued jobs"""
+        if self.started:
+            return
+        self.started = True
+        for worker in self.workers:
+            worker.start()
+
+    def work(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item[0]:
+                return
+            _, _, _, group, args, kwargs = item
+            try:
+                status, short_filepath = utils.download_resource(*args, **kwargs)
+            except BaseException as error:
+                if self.error is None:
+                    self.error = error
+                continue
+            if status == "FAILED" and group is not None:
+                self.failed.add(group)
+            self.statuses.add(status, short_filepath)
+            utils.records.emit("file", status=status, path=short_filepath)
+
+    def results(self) -> utils.FileStatuses:
+        """The statuses of the downloads, once the pool is closed"""
+        if self.error is not None:
+            raise self.error
+        return self.statuses
+
+    def close(self) -> None:
+        self.start()
+        # Stop markers sort after every job, so the queue is drained first
+        for _ in self.workers:
+            self.queue.put((1,))
+        for worker in self.workers:
+            worker.join()
+        if self.extractor is not None:
+            self.extractor.close()
+
+    def __enter__(self) -> "DownloadPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
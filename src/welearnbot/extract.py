@@ -0,0 +1,265 @@
+from welearnbot.utils import log, records
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from time import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import gzip
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import tarfile
+import threading
+import zipfile
+
+if TYPE_CHECKING:
+    from moodlews.profiler import Profiler
+
+GZIP_MAGIC = b"\x1f\x8b"
+SEVENZIP_MAGIC = b"7z\xbc\xaf\x27\x1c"
+
+
+def archive_format(filepath: str) -> Optional[str]:
+    """Detect the real format of an archive from its contents, not its name"""
+    if zipfile.is_zipfile(filepath):
+        return "zip"
+    # Also recognises compressed tarballs such as .tgz and .tar.gz
+    if tarfile.is_tarfile(filepath):
+        return "tar"
+    with open(filepath, "rb") as archive:
+        magic = archive.read(len(SEVENZIP_MAGIC))
+    if magic.startswith(SEVENZIP_MAGIC):
+        return "7z"
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    return None
+
+
+def manifest_path(filepath: str, target_dir: str) -> str:
+    """Where the members last extracted from an archive are recorded"""
+    return os.path.join(target_dir, f".{os.path.basename(filepath)}.members.json")
+
+
+def read_manifest(path: str) -> Dict[str, list]:
+    try:
+        with open(path) as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+
+
+def member_path(target_dir: str, name: str) -> Optional[str]:
+    """Where a member is extracted to, or None if that is outside `target_dir`
+
+    Names such as "../notes.txt" or "/etc/hosts" are never extracted,
+    recorded or pruned, so a crafted or careless archive cannot reach
+    files outside the course folder.
+    """
+    root = os.path.realpath(target_dir)
+    path = os.path.realpath(os.path.join(root, name))
+    if path == root or os.path.commonpath([root, path]) != root:
+        return None
+    return path
+
+
+def unchanged(
+    target_dir: str, name: str, signature: list, old: Dict[str, list]
+) -> bool:
+    """Whether a member matches the last extraction and is still on disk intact"""
+    if old.get(name) != signature:
+        return False
+    try:
+        return os.path.getsize(member_path(target_dir, name)) == signature[0]
+    except (OSError, TypeError):
+        return False
+
+
+def extract_archive(filepath: str, target_dir: str, prune: bool = False) -> str:
+    """Extract an archive into `target_dir` and report what was written
+
+    Every extracted member is recorded with its size and CRC (or mtime for
+    tarballs) next to the archive. When an archive is downloaded again,
+    only members that were added or changed since are written, and with
+    `prune` the files of members that no longer exist are removed.
+
+    Runs in a worker process, so it only takes and returns plain values.
+    """
+    kind = archive_format(filepath)
+    manifest = manifest_path(filepath, target_dir)
+    old = read_manifest(manifest)
+
+    if kind == "zip":
+        with zipfile.ZipFile(filepath, "r") as archive:
+            members = {
+                info.filename: [info.file_size, info.CRC]
+                for info in archive.infolist()
+                if not info.is_dir() and member_path(target_dir, info.filename)
+            }
+            changed = [
+                name
+                for name, signature in members.items()
+                if not unchanged(target_dir, name, signature, old)
+            ]
+            archive.extractall(target_dir, members=changed)
+    elif kind == "tar":
+        with tarfile.open(filepath) as archive:
+            entries = archive.getmembers()
+            members = {
+                entry.name: [entry.size, int(entry.mtime)]
+                for entry in entries
+                if entry.isfile() and member_path(target_dir, entry.name)
+            }
+            # Directories and links are cheap, so they are always extracted
+            selected = [
+                entry
+                for entry in entries
+                if member_path(target_dir, entry.name)
+                and (
+                    not entry.isfile()
+                    or not unchanged(target_dir, entry.name, members[entry.name], old)
+                )
+            ]
+            changed = [entry.name for entry in selected if entry.isfile()]
+            if hasattr(tarfile, "data_filter"):
+                # Refuse members that would land outside target_dir
+                archive.extractall(target_dir, members=selected, filter="data")
+            else:
+                archive.extractall(target_dir, members=selected)
+    elif kind == "gzip":
+        # A single compressed file, named after the archive
+        name, extension = os.path.splitext(os.path.basename(filepath))
+        if extension.upper() not in (".GZ", ".GZIP"):
+            name += ".out"
+        # The gzip trailer holds the CRC and size of the uncompressed data
+        with open(filepath, "rb") as archive:
+            archive.seek(-8, os.SEEK_END)
+            crc, size = struct.unpack("<II", archive.read(8))
+        members = {name: [size, crc]}
+        changed = [name]
+        if unchanged(target_dir, name, members[name], old):
+            changed = []
+        else:
+            with gzip.open(filepath, "rb") as source, open(
+                os.path.join(target_dir, name), "wb"
+            ) as target:
+                shutil.copyfileobj(source, target)
+    elif kind == "7z":
+        try:
+            import py7zr
+        except ImportError:
+            raise RuntimeError("install py7zr to extract 7z archives")
+        with py7zr.SevenZipFile(filepath, "r") as archive:
+            members = {
+                info.filename: [info.uncompressed, info.crc32]
+                for info in archive.list()
+                if not info.is_directory and member_path(target_dir, info.filename)
+            }
+            changed = [
+                name
+                for name, signature in members.items()
+                if not unchanged(target_dir, name, signature, old)
+            ]
+            archive.reset()
+            if changed:
+                archive.extract(target_dir, targets=changed)
+    else:
+        raise RuntimeError("not a supported archive")
+
+    removed = 0
+    if prune:
+        for name in set(old) - set(members):
+            path = member_path(target_dir, name)
+            if path is None:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+
+    with open(manifest, "w") as manifest_file:
+        json.dump(members, manifest_file)
+
+    summary = f"{len(changed)} written, {len(members) - len(changed)} unchanged"
+    if removed:
+        summary += f", {removed} removed"
+    return summary
+
+
+def timed_extract_archive(
+    filepath: str, target_dir: str, prune: bool = False
+) -> Tuple[str, float, float, int]:
+    """`extract_archive`, also returning when and in which process it ran"""
+    start = time()
+    summary = extract_archive(filepath, target_dir, prune)
+    return summary, start, time(), os.getpid()
+
+
+class ExtractionPool:
+    """Extract downloaded archives on a pool of worker processes
+
+    Extraction is CPU and disk bound, so it runs apart from the download
+    threads, which carry on fetching files in the meantime. Archives are
+    submitted from those threads, so the workers are started under a lock,
+    and never by forking them: a fork copies whatever locks the other
+    threads hold at that moment.
+    """
+
+    def __init__(self, workers: Optional[int] = None, prune: bool = False) -> None:
+        self.workers = workers
+        self.prune = prune
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.futures: List[Future] = []
+        self.lock = threading.Lock()
+
+    def submit(
+        self,
+        filepath: str,
+        target_dir: str,
+        short_filepath: str,
+        profiler: Optional["Profiler"] = None,
+    ) -> Future:
+        extract = extract_archive if profiler is None else timed_extract_archive
+        with self.lock:
+            # Only start the worker processes once there is an archive to extract
+            if self.executor is None:
+                method = (
+                    "forkserver"
+                    if "forkserver" in multiprocessing.get_all_start_methods()
+                    else "spawn"
+                )
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(method),
+                )
+            future = self.executor.submit(extract, filepath, target_dir, self.prune)
+            self.futures.append(future)
+        future.add_done_callback(
+            lambda future: self.report(future, short_filepath, profiler)
+        )
+        return future
+
+    @staticmethod
+    def report(
+        future: Future, short_filepath: str, profiler: Optional["Profiler"] = None
+    ) -> None:
+        try:
+            result = future.result()
+        except Exception as error:
+            records.emit(
+                "extract", status="FAILED", path=short_filepath, error=str(error)
+            )
+            log(f"Extracting {short_filepath} ... FAILED ({error})", flush=True)
+            return
+        summary = result
+        if profiler is not None:
+            summary, start, end, pid = result
+            profiler.record_wall("extract", "archive", start, end, pid)
+        records.emit("extract", status="DONE", path=short_filepath, summary=summary)
+        log(f"Extracting {short_filepath} ... DONE ({summary})", flush=True)
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
@@ -1,10 +1,11 @@
-from welearnbot.constants import EVENT_CACHE
+from welearnbot.constants import EVENT_CACHE, EVENT_SYNC_CACHE
 
-from typing import Any, Tuple
+from typing import Any, Dict, List, Tuple
 
 from configparser import RawConfigParser
 from datetime import datetime, timedelta
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -13,7 +14,7 @@ import errno
 import os
 import sys
 
-from welearnbot.utils import create_event, read_cache, write_cache
+from welearnbot.utils import create_event, log, read_cache, write_cache
 
 
 def setup_gcal(config: RawConfigParser) -> Tuple[str, Any]:
@@ -67,50 +68,142 @@ def setup_gcal(config: RawConfigParser) -> Tuple[str, Any]:
     return gcal_calendar_id, service
 
 
-def publish_gcal_event(
-    config: RawConfigParser,
-    duedate: datetime,
-    course_name: str,
-    name: str,
-    assignment_id: int,
-    detail: str,
-) -> None:
-    event_cache_filepath = os.path.expanduser(EVENT_CACHE)
-    event_cache = read_cache(event_cache_filepath)
-
-    # Put deadline at the *end* of the event
-    startdate = duedate - timedelta(hours=1)
-    start_time = startdate.isoformat()
-    end_time = duedate.isoformat()
-    event_name = f"{course_name} - {name}"
-
-    gcal_calendar_id, service = setup_gcal(config)
-
-    assignment_id = str(assignment_id)
-    if assignment_id not in event_cache:
-        # Create and push a new event
-        event = create_event(event_name, detail, start_time, end_time, False)
-        added_event = (
-            service.events().insert(calendarId=gcal_calendar_id, body=event).execute()
-        )
-        event_id = added_event["id"]
-        event_cache[assignment_id] = event_id
-        print(f"        Added event to calendar.")
-    else:
-        # Update event if necessary
-        event = (
-            service.events()
-            .get(calendarId=gcal_calendar_id, eventId=event_cache[assignment_id],)
-            .execute()
+class CalendarSync:
+    """Publish due assignments to Google Calendar in batches
+
+    The calendar service is built once per run, and only if there are
+    events to send, so a run with nothing due never logs in to Google.
+    Events are queued with `add` and sent by `flush` as batch requests.
+    Instead of fetching every known event, the events created earlier are
+    reconciled with an incremental `events.list` using the `syncToken`
+    saved by the previous run. A stand-in for the Calendar API can be
+    passed as `service`.
+    """
+
+    BATCH_SIZE = 50
+
+    def __init__(
+        self, config: RawConfigParser, service: Any = None, calendar_id: str = None
+    ) -> None:
+        self.config = config
+        self.service = service
+        self.calendar_id = calendar_id or "primary"
+        self.event_cache_filepath = os.path.expanduser(EVENT_CACHE)
+        self.event_cache = read_cache(self.event_cache_filepath)
+        self.sync_state_filepath = os.path.expanduser(EVENT_SYNC_CACHE)
+        self.sync_state = read_cache(self.sync_state_filepath)
+        self.pending: List[Dict[str, str]] = []
+
+    def add(
+        self,
+        duedate: datetime,
+        course_name: str,
+        name: str,
+        assignment_id: int,
+        detail: str,
+    ) -> None:
+        # Put deadline at the *end* of the event
+        startdate = duedate - timedelta(hours=1)
+        self.pending.append(
+            {
+                "assignment_id": str(assignment_id),
+                "name": f"{course_name} - {name}",
+                "detail": detail,
+                "start": startdate.isoformat(),
+                "end": duedate.isoformat(),
+            }
         )
-        if event["start"]["dateTime"] != (start_time + "+05:30"):
-            event["start"]["dateTime"] = start_time
-            event["end"]["dateTime"] = end_time
-            updated_event = (
-                service.events()
-                .update(calendarId=gcal_calendar_id, eventId=event["id"], body=event,)
-                .execute()
-            )
-            event_cache[assignment_id] = updated_event["id"]
-            print(f"        Updated event in calendar.")
-    write_cache(event_cache_filepath, event_cache)
+
+    def reconcile(self) -> Dict[str, Any]:
+        """Bring the known state of our events up to date and return it"""
+        tracked = set(self.event_cache.values())
+        known = self.sync_state.setdefault("events", {})
+        page_token = None
+        while True:
+            request = {
+                "calendarId": self.calendar_id,
+                "maxResults": 2500,
+                "pageToken": page_token,
+            }
+            if self.sync_state.get("sync_token"):
+                request["syncToken"] = self.sync_state["sync_token"]
+            try:
+                page = self.service.events().list(**request).execute()
+            except HttpError as error:
+                if error.resp.status != 410:
+                    raise
+                # The sync token expired, so start over with a full sync
+                self.sync_state = {}
+                known = self.sync_state.setdefault("events", {})
+                page_token = None
+                continue
+            for event in page.get("items", []):
+                if event["id"] in tracked:
+                    known[event["id"]] = {
+                        "status": event.get("status"),
+                        "start": event.get("start", {}).get("dateTime"),
+                    }
+            page_token = page.get("nextPageToken")
+            if page_token is None:
+                self.sync_state["sync_token"] = page.get("nextSyncToken")
+                return known
+
+    def flush(self) -> None:
+        """Insert new events and move rescheduled ones, in batches"""
+        if not self.pending:
+            return
+        if self.service is None:
+            self.calendar_id, self.service = setup_gcal(self.config)
+        known = self.reconcile()
+
+        requests = []
+        for item in self.pending:
+            event_id = self.event_cache.get(item["assignment_id"])
+            state = known.get(event_id)
+            if state is None or state["status"] == "cancelled":
+                # Never created, or deleted from the calendar since
+                event = create_event(
+                    item["name"], item["detail"], item["start"], item["end"], False
+                )
+                request = self.service.events().insert(
+                    calendarId=self.calendar_id, body=event
+                )
+                requests.append((item, "Added event to calendar", request))
+            elif state["start"] != (item["start"] + "+05:30"):
+                times = {
+                    "start": {"dateTime": item["start"], "timeZone": "Asia/Kolkata"},
+                    "end": {"dateTime": item["end"], "timeZone": "Asia/Kolkata"},
+                }
+                request = self.service.events().patch(
+                    calendarId=self.calendar_id, eventId=event_id, body=times
+                )
+                requests.append((item, "Updated event in calendar", request))
+        self.pending = []
+
+        for i in range(0, len(requests), self.BATCH_SIZE):
+            chunk = requests[i : i + self.BATCH_SIZE]
+            batch = self.service.new_batch_http_request()
+            for j, (item, message, request) in enumerate(chunk):
+                batch.add(
+                    request,
+                    callback=self.on_response(item, message, known),
+                    request_id=str(j),
+                )
+            batch.execute()
+
+        write_cache(self.event_cache_filepath, self.event_cache)
+        write_cache(self.sync_state_filepath, self.sync_state)
+
+    def on_response(self, item: Dict[str, str], message: str, known: Dict[str, Any]):
+        def callback(request_id: str, response: Any, exception: Exception) -> None:
+            if exception is not None:
+                log(f"        Could not sync {item['name']} ({exception})")
+                return
+            self.event_cache[item["assignment_id"]] = response["id"]
+            known[response["id"]] = {
+                "status": response.get("status"),
+                "start": response.get("start", {}).get("dateTime"),
+            }
+            log(f"        {message}: {item['name']}")
+
+        return callback
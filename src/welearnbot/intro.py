@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from html.entities import html5
+from html.parser import HTMLParser
+from typing import Iterator, List, Optional
+
+import hashlib
+import html
+import json
+
+# Tags whose contents are not part of the visible text
+HIDDEN_TAGS = {"script", "style", "template"}
+# Tags in which whitespace is kept as it is
+PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+# Rendered intros kept at most
+MEMO_SIZE = 1024
+
+
+class TextExtractor(HTMLParser):
+    """Collect the text of an HTML fragment as it is parsed
+
+    The result matches `BeautifulSoup(html, "html.parser").text`: entities
+    are decoded, comments, declarations, processing instructions and the
+    contents of script, style and template tags are dropped, and a run of
+    text between two tags that is only whitespace becomes a single newline
+    or space.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=False)
+        self.parts: List[str] = []
+        # Text since the last tag, which BeautifulSoup keeps as one string
+        self.pending: List[str] = []
+        self.hidden = 0
+        self.preserve = 0
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        text = "".join(self.pending)
+        self.pending = []
+        if not self.preserve and not text.strip(ASCII_SPACES):
+            text = "\n" if "\n" in text else " "
+        if not self.hidden:
+            self.parts.append(text)
+
+    def handle_starttag(self, tag, attrs) -> None:
+        self.flush()
+        if tag in HIDDEN_TAGS:
+            self.hidden += 1
+        elif tag in PRESERVE_WHITESPACE_TAGS:
+            self.preserve += 1
+
+    def handle_startendtag(self, tag, attrs) -> None:
+        # Self-closing tags hold no text, even hidden ones
+        self.flush()
+
+    def handle_endtag(self, tag) -> None:
+        self.flush()
+        if tag in HIDDEN_TAGS and self.hidden:
+            self.hidden -= 1
+        elif tag in PRESERVE_WHITESPACE_TAGS and self.preserve:
+            self.preserve -= 1
+
+    def handle_data(self, data) -> None:
+        self.pending.append(data)
+
+    def handle_entityref(self, name) -> None:
+        # Unknown entities are kept as written, without their semicolon
+        self.pending.append(html5.get(name + ";", "&" + name))
+
+    def handle_charref(self, name) -> None:
+        self.pending.append(html.unescape(f"&#{name};"))
+
+    def handle_comment(self, data) -> None:
+        self.flush()
+
+    def handle_decl(self, decl) -> None:
+        self.flush()
+
+    def handle_pi(self, data) -> None:
+        self.flush()
+
+    def unknown_decl(self, data) -> None:
+        # CDATA sections are kept as text of their own
+        self.flush()
+        if data.startswith("CDATA["):
+            self.pending.append(data[len("CDATA[") :])
+            self.flush()
+
+    def text(self) -> str:
+        self.flush()
+        return "".join(self.parts)
+
+
+def html_to_text(markup: str) -> str:
+    """Strip the tags from an HTML fragment, decoding entities"""
+    parser = TextExtractor()
+    parser.feed(markup)
+    parser.close()
+    return parser.text()
+
+
+class IntroMemo:
+    """Rendered intros keyed by a hash of their HTML, least recently used first
+
+    Once `size` intros are kept, the one used longest ago makes way for a
+    new one. The memo can be saved to a file, so that later runs do not
+    render the same intros again.
+    """
+
+    def __init__(self, size: int = MEMO_SIZE) -> None:
+        self.size = size
+        self.texts: "OrderedDict[str, str]" = OrderedDict()
+        # Whether there are renders that are not saved yet
+        self.changed = False
+        self.loaded: Optional[str] = None
+
+    def render(self, markup: str) -> str:
+        key = hashlib.blake2b(markup.encode(), digest_size=16).hexdigest()
+        text = self.texts.get(key)
+        if text is not None:
+            self.texts.move_to_end(key)
+            return text
+        text = html_to_text(markup)
+        self.texts[key] = text
+        if len(self.texts) > self.size:
+            self.texts.popitem(last=False)
+        self.changed = True
+        return text
+
+    def load(self, filepath: str) -> None:
+        """Read the renders saved in `filepath`, unless already read"""
+        if self.loaded == filepath:
+            return
+        try:
+            with open(filepath) as memo_file:
+                saved = json.load(memo_file)
+        except (OSError, ValueError):
+            saved = {}
+        if isinstance(saved, dict):
+            # Saved least recently used first, like the memo itself
+            for key, text in list(saved.items())[-self.size :]:
+                self.texts.setdefault(key, text)
+        self.loaded = filepath
+
+    def save(self, filepath: str) -> None:
+        if not self.changed:
+            return
+        with open(filepath, "w") as memo_file:
+            json.dump(self.texts, memo_file)
+        self.changed = False
+
+    @contextmanager
+    def saved(self, filepath: str) -> Iterator[None]:
+        """Use the renders saved in `filepath`, and save new ones there after"""
+        self.load(filepath)
+        try:
+            yield
+        finally:
+            self.save(filepath)
+
+
+memo = IntroMemo()
+
+
+def render_intro(markup: str) -> str:
+    """The text of an assignment or URL intro, reusing earlier renders"""
+    return memo.render(markup)
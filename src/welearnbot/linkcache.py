@@ -0,0 +1,210 @@
+from welearnbot.constants import LEGACY_LINK_CACHE
+
+from time import time
+from typing import Dict, Optional, Tuple
+
+import json
+import os
+import sqlite3
+import threading
+
+
+class LinkCache:
+    """Record of downloaded files, stored in an SQLite database
+
+    There is one row per file url, holding the `timemodified` of the version
+    on disk, its local path and size, its course, and when the url was last
+    seen on the server. Every download is committed as soon as it finishes,
+    so an interrupted run keeps track of everything fetched so far. Files
+    looked up are marked as seen in batches, so that a run that downloads
+    nothing does not hold a write lock on the database while it runs.
+    """
+
+    # Lookups marked as seen before they are written out
+    SEEN_BATCH = 1000
+
+    def __init__(self, filepath: str) -> None:
+        self.lock = threading.Lock()
+        # fileurl -> (time seen, course) of lookups not written out yet
+        self.seen: Dict[str, Tuple[float, Optional[str]]] = {}
+        new = not os.path.exists(filepath)
+        self.connection = sqlite3.connect(filepath, timeout=30, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    fileurl TEXT PRIMARY KEY,
+                    timemodified INTEGER NOT NULL,
+                    path TEXT,
+                    size INTEGER,
+                    last_seen REAL NOT NULL,
+                    course TEXT
+                )"""
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS files_last_seen ON files (last_seen)"
+            )
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS course_sync (
+                    courseid INTEGER PRIMARY KEY,
+                    synced INTEGER NOT NULL,
+                    ignored TEXT
+                )"""
+            )
+        if new:
+            self.migrate(os.path.join(os.path.dirname(filepath), LEGACY_LINK_CACHE))
+        else:
+            self.add_course_column(os.path.dirname(filepath))
+            self.add_ignored_column()
+
+    def add_course_column(self, prefix: str) -> None:
+        """Add the course of every file to a cache written by older versions
+
+        The course is the first folder of the path under `prefix`.
+        """
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(files)")
+        ]
+        if "course" in columns:
+            return
+        rows = self.connection.execute(
+            "SELECT fileurl, path FROM files WHERE path IS NOT NULL"
+        ).fetchall()
+        with self.lock, self.connection:
+            self.connection.execute("ALTER TABLE files ADD COLUMN course TEXT")
+            self.connection.executemany(
+                "UPDATE files SET course = ? WHERE fileurl = ?",
+                [
+                    (os.path.relpath(path, prefix).split(os.sep)[0], fileurl)
+                    for fileurl, path in rows
+                ],
+            )
+
+    def add_ignored_column(self) -> None:
+        """Record the ignored file types with the sync times of older caches
+
+        They are unknown, so every course is walked once more.
+        """
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(course_sync)")
+        ]
+        if "ignored" not in columns:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "ALTER TABLE course_sync ADD COLUMN ignored TEXT"
+                )
+
+    def migrate(self, legacy_filepath: str) -> None:
+        """Import the JSON link cache used by older versions"""
+        if not os.path.exists(legacy_filepath):
+            return
+        try:
+            with open(legacy_filepath) as legacy_file:
+                legacy = json.load(legacy_file)
+        except ValueError:
+            return
+        now = time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO files (fileurl, timemodified, last_seen) "
+                "VALUES (?, ?, ?)",
+                [(url, int(timemodified), now) for url, timemodified in legacy.items()],
+            )
+        os.replace(legacy_filepath, legacy_filepath + ".bak")
+
+    def get(self, fileurl: str, course: Optional[str] = None) -> Optional[int]:
+        """Return the cached `timemodified` of a file, and mark it as seen"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT timemodified FROM files WHERE fileurl = ?", (fileurl,)
+            ).fetchone()
+            if row is not None:
+                self.seen[fileurl] = (time(), course)
+                if len(self.seen) >= self.SEEN_BATCH:
+                    with self.connection:
+                        self.write_seen()
+        return None if row is None else row[0]
+
+    def write_seen(self) -> None:
+        # Called with the lock held, inside a transaction
+        self.connection.executemany(
+            "UPDATE files SET last_seen = ?, course = COALESCE(course, ?) "
+            "WHERE fileurl = ?",
+            [(seen, course, fileurl) for fileurl, (seen, course) in self.seen.items()],
+        )
+        self.seen.clear()
+
+    def record(
+        self,
+        fileurl: str,
+        timemodified: int,
+        path: str,
+        size: int,
+        course: Optional[str] = None,
+    ) -> None:
+        """Store a finished download and commit it straight away"""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (fileurl, timemodified, path, size, time(), course),
+            )
+
+    def touch_course(self, course: str) -> None:
+        """Mark every file of a course as seen
+
+        For courses that were not walked because nothing changed, so that
+        `compact` keeps their files.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE files SET last_seen = ? WHERE course = ?", (time(), course)
+            )
+
+    def last_sync(self, courseid: int, ignored: str = "") -> int:
+        """Time of the last complete sync of a course, or 0 if never synced
+
+        A sync that ignored other file types than `ignored` does not count,
+        as files it skipped may have to be downloaded now.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT synced, ignored FROM course_sync WHERE courseid = ?",
+                (courseid,),
+            ).fetchone()
+        if row is None or row[1] != ignored:
+            return 0
+        return row[0]
+
+    def record_sync(self, courseid: int, synced: int, ignored: str = "") -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO course_sync (courseid, synced, ignored) "
+                "VALUES (?, ?, ?)",
+                (courseid, synced, ignored),
+            )
+
+    def compact(self, max_age: float) -> int:
+        """Drop entries not seen on the server for `max_age` seconds
+
+        Entries whose course is unknown, carried over from the JSON cache,
+        are kept: `touch_course` cannot mark them as seen while their course
+        goes unchanged. Seeing them in a walk fills in their course.
+        Returns the number of entries removed.
+        """
+        with self.lock, self.connection:
+            removed = self.connection.execute(
+                "DELETE FROM files WHERE last_seen < ? AND course IS NOT NULL",
+                (time() - max_age,),
+            ).rowcount
+        with self.lock:
+            self.connection.execute("VACUUM")
+        return removed
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            with self.connection:
+                self.write_seen()
+            self.connection.close()
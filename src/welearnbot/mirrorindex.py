@@ -0,0 +1,59 @@
+from typing import Dict, Optional, Set
+
+import os
+import threading
+
+
+class MirrorIndex:
+    """Names of the files in the local mirror, read once per directory
+
+    Checking whether every listed file is already downloaded would take a
+    stat per file, which adds up on a network filesystem. Instead, each
+    directory is read with a single `os.scandir` the first time a file in
+    it is looked up, and later lookups are answered from memory. Files
+    downloaded and directories created during the run are added as they
+    appear, so the index stays current. Download workers share one index.
+    """
+
+    def __init__(self) -> None:
+        # None marks a directory that does not exist (yet)
+        self.directories: Dict[str, Optional[Set[str]]] = {}
+        self.lock = threading.Lock()
+
+    def entries(self, directory: str) -> Optional[Set[str]]:
+        with self.lock:
+            if directory not in self.directories:
+                try:
+                    with os.scandir(directory) as scan:
+                        names: Optional[Set[str]] = {entry.name for entry in scan}
+                except (FileNotFoundError, NotADirectoryError):
+                    names = None
+                self.directories[directory] = names
+            return self.directories[directory]
+
+    def exists(self, path: str) -> bool:
+        directory, name = os.path.split(path)
+        names = self.entries(directory)
+        return names is not None and name in names
+
+    def makedirs(self, directory: str) -> None:
+        """Create a directory and its parents, unless it already exists"""
+        if self.entries(directory) is not None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            # Parents read before they were created hold stale names, so
+            # read them again when next needed
+            parent = os.path.dirname(directory)
+            while parent in self.directories and self.directories[parent] is None:
+                del self.directories[parent]
+                parent = os.path.dirname(parent)
+            self.directories[directory] = set()
+
+    def add(self, path: str) -> None:
+        """Record a file written during the run"""
+        directory, name = os.path.split(path)
+        with self.lock:
+            names = self.directories.get(directory)
+            if names is not None:
+                names.add(name)
@@ -0,0 +1,94 @@
+from typing import Optional
+
+import errno
+import os
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where only hardlinks are used
+    fcntl = None
+
+# Linux ioctl for cloning the blocks of a file on copy-on-write filesystems
+FICLONE = 0x40049409
+
+
+class ObjectStore:
+    """Content addressed store of downloaded files
+
+    Each unique file is kept once under `root`, named after its SHA-1 (the
+    hash Moodle itself uses for `contenthash`). Files in the course folders
+    are reflinks to the stored object where the filesystem supports them,
+    hardlinks otherwise, so repeated attachments take up space only once.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def has(self, digest: Optional[str]) -> bool:
+        return bool(digest) and os.path.exists(self.path(digest))
+
+    def add(self, filepath: str, digest: str) -> None:
+        """Store a downloaded file, replacing it by a link if already stored"""
+        objpath = self.path(digest)
+        if os.path.exists(objpath):
+            self.materialise(digest, filepath)
+            return
+        os.makedirs(os.path.dirname(objpath), exist_ok=True)
+        try:
+            os.link(filepath, objpath)
+        except FileExistsError:
+            # Another worker stored the same content meanwhile
+            self.materialise(digest, filepath)
+        except OSError:
+            shutil.copyfile(filepath, objpath)
+
+    def materialise(self, digest: str, filepath: str) -> None:
+        """Place a stored object at `filepath`, atomically replacing any file there"""
+        objpath = self.path(digest)
+        fd, temppath = tempfile.mkstemp(
+            dir=os.path.dirname(filepath), prefix="." + os.path.basename(filepath)
+        )
+        os.close(fd)
+        try:
+            os.remove(temppath)
+            try:
+                reflink(objpath, temppath)
+            except OSError:
+                try:
+                    os.link(objpath, temppath)
+                except OSError:
+                    shutil.copyfile(objpath, temppath)
+            os.replace(temppath, filepath)
+        except BaseException:
+            if os.path.exists(temppath):
+                os.remove(temppath)
+            raise
+
+
+def reflink(source: str, target: str) -> None:
+    """Clone `source` to `target` sharing the same disk blocks
+
+    Raises OSError when the filesystem cannot do this.
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(target)
+            raise
+
+
+def hash_file(digest, filepath: str, chunk_size: int = 1 << 20) -> None:
+    """Feed the contents of a file on disk to a hashlib object"""
+    with open(filepath, "rb") as stored:
+        for chunk in iter(lambda: stored.read(chunk_size), b""):
+            digest.update(chunk)
@@ -18,7 +18,9 @@ def setup_parser() -> ArgumentParser:
     urls        - lists urls\n\
     courses     - lists enrolled courses\n\
     whoami      - shows the user's name and exits\n\
-    Abbreviations such as any one of 'f', 'a', 's', 'u', 'c', 'w' are supported.",
+    prune       - removes stale entries from the link cache\n\
+    daemon      - keeps running the actions from the [daemon] section on a schedule\n\
+    Abbreviations such as any one of 'f', 'a', 's', 'u', 'c', 'w', 'p', 'd' are supported.",
     )
     parser.add_argument(
         "courses",
@@ -79,4 +81,48 @@ def setup_parser() -> ArgumentParser:
         action="store_true",
         help="re-download those files which were downloaded earlier but deleted/moved from their location",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="fetch fresh data from WeLearn and drop the cached responses",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="store identical files only once and link them into course folders, overrides .welearnrc",
+    )
+    parser.add_argument(
+        "--no-extract",
+        action="store_true",
+        help="do not extract downloaded archives, overrides .welearnrc",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        nargs=1,
+        type=int,
+        help="number of files to download in parallel, overrides .welearnrc",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        nargs=1,
+        metavar="RATE",
+        help="limit downloads to RATE bytes per second in total, e.g. 500K or 2M,\n\
+    overrides .welearnrc",
+    )
+    parser.add_argument(
+        "--output",
+        choices=["text", "ndjson"],
+        default="text",
+        help="print human readable text, or one JSON record per line for every\n\
+    course, assignment, url and file, with the text moved to stderr",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="welearn_profile.json",
+        metavar="TRACE",
+        help="time requests, downloads and extraction, print a summary and write a\n\
+    Chrome trace to TRACE (welearn_profile.json by default)",
+    )
     return parser
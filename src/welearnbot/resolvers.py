@@ -1,9 +1,21 @@
-from moodlews.service import MoodleClient, ServerFunctions
-from welearnbot.utils import get_rolls
+from moodlews.scheduler import DEFAULT_SETTINGS
+from moodlews.service import MoodleClient, ResponseCache, ServerFunctions
+from welearnbot.constants import (
+    BASEURL,
+    COURSE_CACHE_MAX_AGE,
+    DAEMON_INTERVALS,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_JOBS,
+    DOWNLOAD_ORDER,
+    LINK_CACHE_MAX_AGE,
+    RESPONSE_CACHE,
+)
+from welearnbot.utils import get_rolls, parse_size
 
 from argparse import Namespace
 from configparser import RawConfigParser
-from typing import Tuple, List
+from typing import List, Optional, Tuple
 
 import errno
 import getpass
@@ -26,6 +38,10 @@ def resolve_action_mode(args: Namespace) -> str:
         action = "courses"
     elif "whoami".startswith(args.action[0]):
         action = "whoami"
+    elif "prune".startswith(args.action[0]):
+        action = "prune"
+    elif "daemon".startswith(args.action[0]):
+        action = "daemon"
     else:
         print("Invalid action! Use the -h flag for usage.")
         sys.exit(errno.EPERM)
@@ -48,6 +64,15 @@ def resolve_action_mode(args: Namespace) -> str:
     return action
 
 
+def expand_all_courses(config: RawConfigParser, args: Namespace, action: str) -> None:
+    # Select all courses from config if `ALL` keyword is used
+    if "ALL" in map(str.upper, args.courses):
+        if action == "submissions":
+            args.courses = list(resolve_submission_details(config).keys())
+        else:
+            args.courses = get_all_courses(config)
+
+
 def get_config() -> RawConfigParser:
     """Read the .welearnrc file from the home directory, and extract username and password"""
     if sys.platform == "linux" or sys.platform == "linux2":
@@ -79,6 +104,23 @@ def get_credentials(config: RawConfigParser) -> Tuple[str, str]:
     return username, password
 
 
+def get_username(config: RawConfigParser) -> Optional[str]:
+    # The configured username, without asking for one
+    try:
+        return config["auth"]["username"]
+    except KeyError:
+        return None
+
+
+def resolve_baseurl(config: RawConfigParser) -> str:
+    # Another Moodle site, such as a local test server, may be set in config
+    try:
+        baseurl = config["auth"]["baseurl"].strip()
+    except KeyError:
+        baseurl = ""
+    return baseurl or BASEURL
+
+
 def get_userid(moodle: MoodleClient):
     site_info = moodle.server(ServerFunctions.SITE_INFO)
     return site_info["userid"]
@@ -134,6 +176,167 @@ def resolve_ignore_types(config: RawConfigParser, args: Namespace) -> List[str]:
     return ignore_types
 
 
+def resolve_jobs(config: RawConfigParser, args: Namespace) -> int:
+    # Read the number of download workers from config
+    try:
+        jobs = int(config["files"]["workers"])
+    except (KeyError, ValueError):
+        jobs = DEFAULT_JOBS
+
+    # Override config with options
+    if args.jobs:
+        jobs = args.jobs[0]
+
+    return max(1, jobs)
+
+
+def resolve_download_order(config: RawConfigParser) -> List[str]:
+    # Read the priority of waiting downloads from config, a comma separated
+    # list of due, size and course; an empty list keeps submission order
+    try:
+        value = config["files"]["order"] or ""
+    except KeyError:
+        return list(DOWNLOAD_ORDER)
+    order = [criterion.strip().lower() for criterion in value.split(",")]
+    order = [criterion for criterion in order if criterion]
+    unknown = [criterion for criterion in order if criterion not in DOWNLOAD_ORDER]
+    if unknown:
+        print(
+            f"Unknown download order {', '.join(unknown)}, "
+            f"expected some of {', '.join(DOWNLOAD_ORDER)}"
+        )
+        sys.exit(errno.EINVAL)
+    return order
+
+
+def resolve_bandwidth(config: RawConfigParser, args: Namespace) -> int:
+    # Read the download bandwidth limit in bytes per second from config,
+    # where 0 means unlimited
+    try:
+        bandwidth = parse_size(config["network"]["bandwidth"])
+    except (KeyError, ValueError):
+        bandwidth = 0
+
+    # Override config with options
+    if args.bandwidth:
+        try:
+            bandwidth = parse_size(args.bandwidth[0])
+        except ValueError:
+            print(f"Invalid bandwidth {args.bandwidth[0]}, expected e.g. 500K or 2M")
+            sys.exit(errno.EINVAL)
+
+    return max(0, bandwidth)
+
+
+def resolve_dedupe(config: RawConfigParser, args: Namespace) -> bool:
+    # Read whether to deduplicate downloads from config
+    try:
+        value = config["files"]["dedupe"]
+        # A bare `dedupe` line turns it on
+        dedupe = value is None or value.strip().lower() in ("true", "yes", "on", "1")
+    except KeyError:
+        dedupe = False
+
+    # Override config with options
+    return dedupe or args.dedupe
+
+
+def resolve_extract(config: RawConfigParser, args: Namespace) -> bool:
+    # Read whether to extract downloaded archives from config
+    try:
+        value = config["files"]["extract"]
+        extract = value is None or value.strip().lower() in ("true", "yes", "on", "1")
+    except KeyError:
+        extract = True
+
+    # Override config with options
+    return extract and not args.no_extract
+
+
+def resolve_prune_extracted(config: RawConfigParser) -> bool:
+    # Read whether files of members removed from a re-downloaded archive are deleted
+    try:
+        value = config["files"]["prune_extracted"]
+        return value is None or value.strip().lower() in ("true", "yes", "on", "1")
+    except KeyError:
+        return False
+
+
+def resolve_chunk_size(config: RawConfigParser) -> int:
+    # Read the download chunk size from config, e.g. 64K or 1M
+    try:
+        chunk_size = parse_size(config["files"]["chunk_size"])
+    except (KeyError, ValueError):
+        chunk_size = DEFAULT_CHUNK_SIZE
+    return max(1, chunk_size)
+
+
+def resolve_concurrency(config: RawConfigParser) -> int:
+    # Read the number of web service calls allowed in flight at once
+    try:
+        concurrency = int(config["network"]["concurrency"])
+    except (KeyError, ValueError):
+        concurrency = DEFAULT_CONCURRENCY
+    return max(1, concurrency)
+
+
+def resolve_network_settings(config: RawConfigParser) -> dict:
+    """Read timeouts, retries and concurrency limits from [network]
+
+    Timeouts and backoff are in seconds. `concurrency` is where the number
+    of requests in flight starts, from which it adapts between
+    `min_concurrency` and `max_concurrency`.
+    """
+    try:
+        section = config["network"]
+    except KeyError:
+        section = {}
+    settings = {}
+    for key, default in DEFAULT_SETTINGS.items():
+        try:
+            settings[key] = type(default)(section[key])
+        except (KeyError, ValueError):
+            continue
+    settings["concurrency"] = resolve_concurrency(config)
+    return settings
+
+
+def resolve_link_cache_max_age(config: RawConfigParser) -> float:
+    # Days after which files no longer listed on WeLearn are pruned from the link cache
+    try:
+        return float(config["files"]["link_cache_max_age"])
+    except (KeyError, ValueError):
+        return LINK_CACHE_MAX_AGE
+
+
+def resolve_course_cache_max_age(config: RawConfigParser) -> float:
+    # Days after which a course's participant list is refreshed
+    try:
+        return float(config["cache"]["course_max_age"])
+    except (KeyError, ValueError):
+        return COURSE_CACHE_MAX_AGE
+
+
+def resolve_daemon_settings(config: RawConfigParser) -> Tuple[List[str], dict]:
+    """Read the actions to run and the polling intervals from [daemon]
+
+    Actions are separated by semicolons and written as on the command line,
+    e.g. `actions = files ALL; assignments -d ALL`. Intervals are in seconds.
+    """
+    try:
+        section = config["daemon"]
+    except KeyError:
+        section = {}
+    actions = section.get("actions") or "files ALL; assignments -d ALL"
+    settings = {}
+    for key, default in DAEMON_INTERVALS.items():
+        try:
+            settings[key] = float(section.get(key, default))
+        except (TypeError, ValueError):
+            settings[key] = default
+    return [line.strip() for line in actions.split(";") if line.strip()], settings
+
+
 def resolve_prefix_path(config: RawConfigParser, args: Namespace) -> str:
     # Read pathprefix from config
     try:
@@ -171,3 +374,38 @@ def get_courses_by_id(moodle: MoodleClient, args: Namespace):
         if course_name in args.courses:
             course_ids[course["id"]] = course_name
     return course_ids
+
+
+def resolve_response_cache(config: RawConfigParser, prefix_path: str):
+    """Set up the web service response cache from the [cache] section
+
+    Returns None if the cache is disabled. Any key named after a web service
+    function sets its TTL in seconds, and 0 turns caching off for it.
+    """
+    try:
+        section = config["cache"]
+    except KeyError:
+        section = {}
+    if section.get("enabled", "true").strip().lower() in ("false", "no", "off", "0"):
+        return None
+
+    functions = {
+        value
+        for name, value in vars(ServerFunctions).items()
+        if not name.startswith("_")
+    }
+    ttls = {}
+    for key, value in section.items():
+        if key in functions:
+            try:
+                ttls[key] = int(value)
+            except (TypeError, ValueError):
+                continue
+    try:
+        max_entries = int(section.get("max_entries", 1000))
+    except (TypeError, ValueError):
+        max_entries = 1000
+
+    return ResponseCache(
+        os.path.join(prefix_path, RESPONSE_CACHE), ttls=ttls, max_entries=max_entries
+    )
@@ -1,13 +1,99 @@
 from moodlews.service import MoodleClient, ServerFunctions
-from welearnbot.constants import ARCHIVE_TYPES
+from welearnbot.constants import ARCHIVE_TYPES, COURSE_CACHE_MAX_AGE, OBJECT_STORE
+from welearnbot.linkcache import LinkCache
+from welearnbot.mirrorindex import MirrorIndex
+from welearnbot.objectstore import ObjectStore, hash_file
 
 from argparse import Namespace
-from typing import Any, Dict, List, Tuple
+from requests.exceptions import HTTPError, RequestException
+from time import monotonic, perf_counter, sleep, time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, TextIO, Tuple
 
+import hashlib
 import json
 import os
 import mimetypes
-import zipfile
+import threading
+
+if TYPE_CHECKING:
+    from welearnbot.downloader import TokenBucket
+    from welearnbot.extract import ExtractionPool
+
+# Downloads may run on several worker threads, so console output is
+# guarded by a lock
+print_lock = threading.Lock()
+
+
+def log(*args, **kwargs) -> None:
+    """Print a line without interleaving with other threads"""
+    with print_lock:
+        print(*args, **kwargs)
+
+
+class RecordWriter:
+    """Machine readable output, one JSON object per line
+
+    Every record has a "type", such as "course", "assignment", "url" or
+    "file", and is emitted as soon as it is known. Records are collected
+    in a buffer, which is written out once it holds `buffer_size`
+    characters, at most `interval` seconds after a record arrived, and on
+    `flush`, so a consumer can follow the output without a write per
+    record. Download and extraction workers may emit from any thread.
+    """
+
+    def __init__(self, buffer_size: int = 64 * 1024, interval: float = 0.2) -> None:
+        self.stream: Optional[TextIO] = None
+        self.buffer_size = buffer_size
+        self.interval = interval
+        self.lines: List[str] = []
+        self.buffered = 0
+        self.written = monotonic()
+        # Writes out a buffered record when no other record follows it
+        self.timer: Optional[threading.Timer] = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.stream is not None
+
+    def open(self, stream: TextIO) -> None:
+        self.stream = stream
+
+    def emit(self, record_type: str, **fields) -> None:
+        if self.stream is None:
+            return
+        line = json.dumps({"type": record_type, **fields}, ensure_ascii=False)
+        with self.lock:
+            self.lines.append(line + "\n")
+            self.buffered += len(line) + 1
+            if (
+                self.buffered >= self.buffer_size
+                or monotonic() - self.written >= self.interval
+            ):
+                self.write()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def write(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.stream.write("".join(self.lines))
+        self.stream.flush()
+        self.lines = []
+        self.buffered = 0
+        self.written = monotonic()
+
+    def flush(self) -> None:
+        if self.stream is None:
+            return
+        with self.lock:
+            self.write()
+
+
+records = RecordWriter()
 
 
 def read_cache(filepath: str) -> dict:
@@ -25,40 +111,125 @@ def write_cache(filepath: str, cache: dict) -> None:
         json.dump(cache, cache_file)
 
 
+def read_token(
+    filepath: str, baseurl: str, username: Optional[str] = None
+) -> Optional[str]:
+    """Read the token saved by an earlier run for `baseurl`, if any
+
+    With a `username`, a token saved for another account is not returned.
+    """
+    try:
+        saved = read_cache(filepath).get(baseurl)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(saved, dict):
+        # Tokens saved by older versions do not say whose they are
+        return saved if username is None else None
+    if username is not None and saved.get("username") != username:
+        return None
+    return saved.get("token")
+
+
+def save_token(filepath: str, baseurl: str, username: str, token: str) -> None:
+    """Save the token of `username` where only the current user can read it"""
+    try:
+        tokens = read_cache(filepath)
+    except (OSError, ValueError):
+        tokens = {}
+    tokens[baseurl] = {"username": username, "token": token}
+    descriptor = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # The mode only applies to new files, so tighten existing ones too
+    os.chmod(filepath, 0o600)
+    with os.fdopen(descriptor, "w") as token_file:
+        json.dump(tokens, token_file)
+
+
 def get_courses_cache(
-    moodle: MoodleClient, course_cache_filepath: str, userid: str, update: bool = False,
+    moodle: MoodleClient,
+    course_cache_filepath: str,
+    userid: str,
+    update: bool = False,
+    max_age: float = COURSE_CACHE_MAX_AGE * 24 * 3600,
+    concurrency: int = 8,
 ):
+    """Courses of the user with their participants, cached on disk
+
+    A course is refreshed when its enrolment count changed or its entry is
+    older than `max_age` seconds. Courses missing from the cache are
+    fetched straight away. Otherwise the cached entries are returned at
+    once and refreshed in the background. With `update`, the course list
+    is fetched past the response cache and every course is rebuilt before
+    returning, which also picks up changes the enrolment count misses,
+    such as a student's new idnumber.
+    """
     cache = read_cache(course_cache_filepath)
-    if update or not cache:
-        courses = moodle.server(ServerFunctions.USER_COURSES, {"userid": userid})
-        for course in courses:
-            courseid = course["shortname"]
-            course_data = {
-                "id": course["id"],
-                "courseid": course["shortname"],
-                "name": course["fullname"],
-                "participants": {},
-            }
-            participants = moodle.server(
-                ServerFunctions.COURSE_USERS, {"courseid": course["id"]}
-            )
-            for participant in participants:
-                try:
-                    print(participant["idnumber"])
-                    course_data["participants"][participant["idnumber"]] = {
-                        "id": participant["id"],
-                        "name": participant["fullname"],
-                    }
-                except KeyError:
-                    # skip caching details of participants whose information is not available.
-                    # This mostly happens for instructors
-                    continue
-            cache[courseid] = course_data
-    with open(course_cache_filepath, "w") as f:
-        json.dump(cache, f)
+    courses = moodle.server(
+        ServerFunctions.USER_COURSES, {"userid": userid}, fresh=update
+    )
+    now = time()
+
+    missing = []
+    outdated = []
+    for course in courses:
+        cached = cache.get(course["shortname"])
+        if cached is None:
+            missing.append(course)
+        elif (
+            cached.get("enrolled") != course.get("enrolledusercount")
+            or now - cached.get("fetched", 0) > max_age
+        ):
+            outdated.append(course)
+
+    if update:
+        missing = list(courses)
+        outdated = []
+    if missing:
+        cache.update(fetch_participants(moodle, missing, concurrency))
+        write_cache(course_cache_filepath, cache)
+    if outdated:
+        # Serve the cached entries while they are refreshed
+        def refresh() -> None:
+            refreshed = fetch_participants(moodle, outdated, concurrency)
+            write_cache(course_cache_filepath, dict(cache, **refreshed))
+
+        threading.Thread(target=refresh, name="course-cache-refresh").start()
     return cache
 
 
+def fetch_participants(
+    moodle: MoodleClient, courses: List[Any], concurrency: int = 8
+) -> Dict[str, Any]:
+    """Build course cache entries, fetching all participant lists concurrently"""
+    participant_lists = server_many(
+        moodle,
+        ServerFunctions.COURSE_USERS,
+        [{"courseid": course["id"]} for course in courses],
+        concurrency,
+    )
+    entries = {}
+    for course, participants in zip(courses, participant_lists):
+        course_data = {
+            "id": course["id"],
+            "courseid": course["shortname"],
+            "name": course["fullname"],
+            "participants": {},
+            "enrolled": course.get("enrolledusercount"),
+            "fetched": time(),
+        }
+        for participant in participants:
+            try:
+                course_data["participants"][participant["idnumber"]] = {
+                    "id": participant["id"],
+                    "name": participant["fullname"],
+                }
+            except KeyError:
+                # skip caching details of participants whose information is not available.
+                # This mostly happens for instructors
+                continue
+        entries[course["shortname"]] = course_data
+    return entries
+
+
 def fetch_assignments(moodle, courseid) -> List[Any]:
     assignments = moodle.server(
         ServerFunctions.ASSIGNMENTS, {"courseids[0]": courseid}  # cache[course]["id"]}
@@ -78,6 +249,86 @@ def fetch_assignments(moodle, courseid) -> List[Any]:
     ]
 
 
+def fetch_submissions(
+    moodle: MoodleClient, assignment_ids: List[int], since: int = 0
+) -> Dict[int, List[Any]]:
+    """Fetch the submissions of all students to several assignments in one call
+
+    Only submissions modified after the `since` timestamp are returned.
+    """
+    if not assignment_ids:
+        return {}
+    data = {
+        f"assignmentids[{i}]": assignment_id
+        for i, assignment_id in enumerate(assignment_ids)
+    }
+    data["since"] = since
+    response = moodle.server(ServerFunctions.SUBMISSIONS, data)
+    return {
+        assignment["assignmentid"]: assignment["submissions"]
+        for assignment in response.get("assignments", [])
+    }
+
+
+def submission_files(submission: Any) -> List[Any]:
+    """All files in every file area of a submission"""
+    files = []
+    for plugin in submission.get("plugins", []):
+        for filearea in plugin.get("fileareas", []):
+            files.extend(filearea.get("files", []))
+    return files
+
+
+def updated_modules(updates: Any) -> Optional[Set[int]]:
+    """Ids of the course modules listed in a `COURSE_UPDATES` response
+
+    Returns None if the server could not answer, e.g. because the function
+    is not enabled, in which case the whole course has to be checked.
+    """
+    if not isinstance(updates, dict) or "instances" not in updates:
+        return None
+    return {
+        instance["id"]
+        for instance in updates["instances"]
+        if instance.get("contextlevel") == "module"
+    }
+
+
+def server_many(
+    moodle: MoodleClient, function: str, datas: List[dict], limit: int = 8
+) -> List[Any]:
+    """Make several calls to the same web service function concurrently
+
+    The calls share the login of `moodle` and run on an `AsyncMoodleClient`,
+    with at most `limit` requests in flight. Results keep the order of `datas`.
+    Calls rejected for an expired token are sent again once `moodle` has
+    logged in again.
+    """
+    if not datas:
+        return []
+
+    import asyncio
+    from moodlews.async_service import AsyncMoodleClient
+
+    async def gather(datas: List[dict]) -> List[Any]:
+        async with AsyncMoodleClient.from_client(
+            moodle, limit_per_host=limit
+        ) as client:
+            return await client.server_many(function, datas)
+
+    token = moodle.token
+    results = asyncio.run(gather(datas))
+    rejected = [
+        index for index, result in enumerate(results) if moodle.invalid_token(result)
+    ]
+    if rejected and moodle.reauthenticate is not None:
+        moodle.refresh_token(token)
+        retried = asyncio.run(gather([datas[index] for index in rejected]))
+        for index, result in zip(rejected, retried):
+            results[index] = result
+    return results
+
+
 def create_event(
     name: str, description: str, start: str, end: str, reminders: bool = True
 ) -> Dict[str, Any]:
@@ -103,13 +354,23 @@ def download_resource(
     resource: Any,
     prefix: str,
     course: str,
-    cache: dict,
+    cache: LinkCache,
     token: str,
     subfolders: List[str] = [],
     indent: int = 0,
-    extract: bool = True,
+    extractor: Optional["ExtractionPool"] = None,
+    bandwidth: Optional["TokenBucket"] = None,
+    index: Optional[MirrorIndex] = None,
 ) -> Tuple[str, str]:
-    """Helper function to retrieve a file/resource from the server"""
+    """Helper function to retrieve a file/resource from the server
+
+    Archives are handed over to `extractor`, if given, once downloaded.
+    The transfer is throttled by `bandwidth`, if given. Existing files and
+    directories are looked up in `index`, which should be shared by all
+    downloads of a run.
+    """
+    if index is None:
+        index = MirrorIndex()
     filename = resource["filename"]
     subfolders = [subfolder.strip() for subfolder in subfolders]
     course_dir = os.path.join(prefix, course, *subfolders)
@@ -126,13 +387,13 @@ def download_resource(
     timemodified = int(resource["timemodified"])
 
     # Only download if forced, or not already downloaded
-    if not args.forcedownload and fileurl in cache:
-        cache_time = int(cache[fileurl])
+    cache_time = cache.get(fileurl, course)
+    if not args.forcedownload and cache_time is not None:
         # Check where the latest version of the file is in cache
         if timemodified == cache_time:
-            if os.path.exists(filepath):
+            if index.exists(filepath):
                 return "EXISTS", short_filepath
-            if not args.missingdownload and not os.path.exists(filepath):
+            if not args.missingdownload:
                 return "MISSING", short_filepath
 
     # Ignore files with specified extensions
@@ -140,79 +401,337 @@ def download_resource(
         return "IGNORE", short_filepath
 
     # Create the course folder if not already existing
-    if not os.path.exists(course_dir):
-        os.makedirs(course_dir)
+    index.makedirs(course_dir)
+
+    store = ObjectStore(os.path.join(prefix, OBJECT_STORE)) if args.dedupe else None
+    contenthash = resource.get("contenthash")
+    if store is not None and store.has(contenthash):
+        # Identical content was downloaded before, so just link to it
+        store.materialise(contenthash, filepath)
+        index.add(filepath)
+        log(" " * indent + "Linking " + short_filepath + " ... DONE", flush=True)
+        # A linked archive is extracted again, as this course has no copy yet
+        if extension in ARCHIVE_TYPES and extractor is not None:
+            extractor.submit(
+                filepath, course_dir, short_filepath, profiler=moodle.profiler
+            )
+        cache.record(
+            fileurl, timemodified, filepath, os.path.getsize(filepath), course
+        )
+        return "DOWNLOADED", short_filepath
 
     # Download the file and write to the folder
-    print(
-        " " * indent + "Downloading " + short_filepath, end="", flush=True,
-    )
-    response = moodle.response(fileurl, token=token)
-    with open(filepath, "wb") as download:
-        download.write(response.content)
+    progress = " " * indent + "Downloading " + short_filepath
+    profiler = moodle.profiler
+    start = perf_counter() if profiler is not None else 0.0
+    scheduler = moodle.scheduler
+    partpath = partial_path(course_dir, filename, timemodified)
+    attempt = 0
+    while True:
+        kept = os.path.getsize(partpath) if os.path.exists(partpath) else 0
+        try:
+            # The client holds a fresh token if it had to log in again
+            digest = stream_to_file(
+                moodle,
+                fileurl,
+                moodle.token or token,
+                course_dir,
+                filepath,
+                timemodified,
+                args.chunk_size,
+                checksum=store is not None,
+                bandwidth=bandwidth,
+            )
+            break
+        except RequestException as error:
+            # The request itself was already retried, but a transfer that
+            # broke off after making progress can resume from its partial file
+            progressed = os.path.exists(partpath) and os.path.getsize(partpath) > kept
+            if not progressed or attempt >= scheduler.retries:
+                reason = type(error).__name__
+                if error.response is not None:
+                    reason = f"HTTP {error.response.status_code}"
+                log(f"{progress} ... FAILED ({reason})", flush=True)
+                return "FAILED", short_filepath
+            sleep(scheduler.delay(attempt))
+            attempt += 1
+    index.add(filepath)
+    if store is not None:
+        store.add(filepath, digest)
+    if profiler is not None:
+        profiler.record(
+            "download",
+            extension or "file",
+            start,
+            perf_counter() - start,
+            bytes=os.path.getsize(filepath),
+            path=short_filepath,
+        )
 
-    # TODO: add option whether to extract or not in the config and flag
-    if extension in ARCHIVE_TYPES and extract:
-        with zipfile.ZipFile(filepath, "r") as zip_ref:
-            zip_ref.extractall(course_dir)
-            print(" ... EXTRACTING", end="", flush=True)
+    # Extraction happens in the background and reports on its own
+    if extension in ARCHIVE_TYPES and extractor is not None:
+        extractor.submit(filepath, course_dir, short_filepath, profiler=profiler)
 
-    print(" ... DONE")
+    # The whole progress line is printed at once, so parallel downloads
+    # do not interleave their output
+    log(progress + " ... DONE", flush=True)
 
     # Add the file url to the cache
-    cache[fileurl] = timemodified
+    cache.record(fileurl, timemodified, filepath, os.path.getsize(filepath), course)
     return "DOWNLOADED", short_filepath
 
 
-def show_file_statuses(file_statuses, verbose=False) -> None:
-    """Helper function to print ignored, missing files"""
-    ignored = []
-    missing = []
-    downloaded = []
-    for status, short_filepath in file_statuses:
-        if status == "IGNORE":
-            ignored.append(short_filepath)
-        elif status == "MISSING":
-            missing.append(short_filepath)
-        elif status == "DOWNLOADED":
-            downloaded.append(short_filepath)
-
-    if len(ignored) > 0:
-        if len(downloaded) > 0:
+class TransferStats:
+    """Running totals of resumed downloads, shared by all download workers"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.resumed_files = 0
+        self.resumed_bytes = 0
+        self.time_saved = 0.0
+
+    def add_resumed(self, resumed_bytes: int, time_saved: float) -> None:
+        with self.lock:
+            self.resumed_files += 1
+            self.resumed_bytes += resumed_bytes
+            self.time_saved += time_saved
+
+
+transfer_stats = TransferStats()
+
+
+def partial_path(course_dir: str, filename: str, timemodified: int) -> str:
+    """Location of the partial download of a given version of a file"""
+    return os.path.join(course_dir, f".{filename}.{timemodified}.part")
+
+
+def remove_stale_partials(course_dir: str, filename: str, keep: str) -> None:
+    """Delete partial downloads of older versions of a file"""
+    prefix = f".{filename}."
+    for entry in os.listdir(course_dir):
+        if not entry.startswith(prefix) or not entry.endswith(".part"):
+            continue
+        if entry[len(prefix) : -len(".part")].isdigit():
+            path = os.path.join(course_dir, entry)
+            if path != keep:
+                os.remove(path)
+
+
+def stream_to_file(
+    moodle: MoodleClient,
+    fileurl: str,
+    token: str,
+    course_dir: str,
+    filepath: str,
+    timemodified: int,
+    chunk_size: int,
+    checksum: bool = False,
+    bandwidth: Optional["TokenBucket"] = None,
+) -> Optional[str]:
+    """Stream a file to disk in chunks of `chunk_size` bytes
+
+    The chunks go to a partial file in `course_dir`, which replaces
+    `filepath` only once the whole file has arrived, so `filepath` never
+    holds a partial download. The partial file is named after the
+    `timemodified` of the version being fetched and is kept if the
+    transfer breaks off, so that the next run can resume it with an HTTP
+    Range request. A partial file of an older version is discarded. Any
+    response other than the whole file or the requested range, such as an
+    error page, raises `HTTPError` without touching the partial file.
+
+    With `checksum`, the SHA-1 of the file is computed on the way and returned.
+    With `bandwidth`, every chunk waits for its share of the limit.
+    """
+    filename = os.path.basename(filepath)
+    partpath = partial_path(course_dir, filename, timemodified)
+    remove_stale_partials(course_dir, filename, keep=partpath)
+
+    offset = os.path.getsize(partpath) if os.path.exists(partpath) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else None
+    response = moodle.response(fileurl, stream=True, headers=headers, token=token)
+    if offset and response.status_code == 416:
+        # The server rejected the range, so fetch the whole file again
+        response.close()
+        offset = 0
+        response = moodle.response(fileurl, stream=True, token=token)
+
+    # Append only if the server honoured the range, start over on a whole
+    # file, and leave the partial file alone on anything else, such as an
+    # error page
+    content_range = response.headers.get("Content-Range", "")
+    if response.status_code == 206 and content_range.startswith(f"bytes {offset}-"):
+        resumed = offset
+    elif response.status_code == 200:
+        resumed = 0
+    else:
+        response.close()
+        raise HTTPError(f"{response.status_code} for {fileurl}", response=response)
+
+    digest = hashlib.sha1() if checksum else None
+    if digest is not None and resumed:
+        hash_file(digest, partpath)
+
+    start = time()
+    received = 0
+    # Time spent writing to disk, measured only while profiling
+    profiler = moodle.profiler
+    write_start = perf_counter()
+    write_time = 0.0
+    with response, open(partpath, "ab" if resumed else "wb") as download:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if profiler is None:
+                download.write(chunk)
+            else:
+                chunk_start = perf_counter()
+                download.write(chunk)
+                write_time += perf_counter() - chunk_start
+            if digest is not None:
+                digest.update(chunk)
+            if bandwidth is not None:
+                bandwidth.consume(len(chunk))
+            received += len(chunk)
+    os.replace(partpath, filepath)
+    if profiler is not None:
+        profiler.record("disk", "write", write_start, write_time, bytes=received)
+
+    if resumed:
+        # Estimate the time saved from the throughput of this transfer
+        elapsed = time() - start
+        time_saved = resumed * elapsed / received if received else 0.0
+        transfer_stats.add_resumed(resumed, time_saved)
+
+    return None if digest is None else digest.hexdigest()
+
+
+def parse_size(size: str) -> int:
+    """Convert a size such as 512, 64K or 2M to a number of bytes"""
+    size = size.strip().upper().rstrip("B")
+    multipliers = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if size and size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def format_size(size: float) -> str:
+    """Human readable form of a number of bytes"""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+
+
+class FileStatuses:
+    """Running totals of the statuses returned by `download_resource`
+
+    Only the counts are kept, along with the courses something was
+    downloaded in, so a run over many files does not pile up a list of
+    them. The ignored and missing files themselves are kept only with
+    `keep_names`, for `show_file_statuses` to list.
+    """
+
+    def __init__(self, keep_names: bool = False) -> None:
+        self.counts: Dict[str, int] = {}
+        self.names: Optional[Dict[str, List[str]]] = None
+        if keep_names:
+            self.names = {"IGNORE": [], "MISSING": []}
+        self.downloaded_courses: Set[str] = set()
+        self.lock = threading.Lock()
+
+    def add(self, status: str, short_filepath: str) -> None:
+        with self.lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+            if status == "DOWNLOADED":
+                self.downloaded_courses.add(short_filepath.split(os.sep)[0])
+            if self.names is not None and status in self.names:
+                self.names[status].append(short_filepath)
+
+
+def show_file_statuses(file_statuses: FileStatuses, verbose=False) -> None:
+    """Helper function to print ignored, missing files
+
+    With machine readable output, every file was already reported as a
+    record, so only the counts are emitted.
+    """
+    counts = file_statuses.counts
+    listed = file_statuses.names or {"IGNORE": [], "MISSING": []}
+
+    if records.enabled:
+        records.emit(
+            "summary",
+            **{status.lower(): count for status, count in sorted(counts.items())},
+            resumed_files=transfer_stats.resumed_files,
+            resumed_bytes=transfer_stats.resumed_bytes,
+        )
+        transfer_stats.reset()
+        return
+
+    ignored = counts.get("IGNORE", 0)
+    missing = counts.get("MISSING", 0)
+    downloaded = counts.get("DOWNLOADED", 0)
+    failed = counts.get("FAILED", 0)
+
+    if ignored > 0:
+        if downloaded > 0:
             print()
         if verbose:
             print("The following files have been ignored.")
-            for short_filepath in ignored:
+            for short_filepath in sorted(listed["IGNORE"]):
                 print("    " + short_filepath)
         else:
-            if len(ignored) == 1:
+            if ignored == 1:
                 print("1 file has been ignored, use --verbose for more info")
             else:
                 print(
                     "{} files have been ignored, use --verbose for more info".format(
-                        len(ignored)
+                        ignored
                     )
                 )
 
-    if len(missing) > 0:
-        if len(ignored) > 0 or len(downloaded) > 0:
+    if missing > 0:
+        if ignored > 0 or downloaded > 0:
             print()
         if verbose:
             print(
                 "The following files are missing, use --missingdownload to download them."
             )
-            for short_filepath in missing:
+            for short_filepath in sorted(listed["MISSING"]):
                 print("    " + short_filepath)
         else:
-            if len(missing) == 1:
+            if missing == 1:
                 print("1 file is missing, use --verbose for more info")
             else:
                 print(
                     "{} files are missing, use --verbose for more info".format(
-                        len(missing)
+                        missing
                     )
                 )
 
+    if failed > 0:
+        if ignored > 0 or missing > 0 or downloaded > 0:
+            print()
+        print(
+            "{} file{} could not be downloaded, run again to resume".format(
+                failed, "" if failed == 1 else "s"
+            )
+        )
+
+    if transfer_stats.resumed_files > 0:
+        if ignored > 0 or missing > 0 or downloaded > 0:
+            print()
+        print(
+            "Resumed {} partial download{}, reusing {} (about {:.1f}s saved)".format(
+                transfer_stats.resumed_files,
+                "" if transfer_stats.resumed_files == 1 else "s",
+                format_size(transfer_stats.resumed_bytes),
+                transfer_stats.time_saved,
+            )
+        )
+    transfer_stats.reset()
+
 
 def get_rolls(roll_string: str) -> List[str]:
     roll_string = roll_string.strip().upper()
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 
+from moodlews.profiler import Profiler
+from moodlews.scheduler import RequestScheduler
 from moodlews.service import MoodleClient
 
 import welearnbot.action_handlers as handler
-from welearnbot import resolvers
-from welearnbot.constants import BASEURL, LINK_CACHE
+from welearnbot import intro, resolvers, utils
+from welearnbot.constants import INTRO_CACHE, LINK_CACHE, TOKEN_CACHE
 from welearnbot.parser import setup_parser
 
+from argparse import ArgumentParser, Namespace
+from configparser import RawConfigParser
+from typing import Optional
+
 import errno
 import os
 import sys
@@ -17,24 +23,115 @@ def main():
     parser = setup_parser()
     args = parser.parse_args()
 
+    if args.output == "ndjson":
+        # Records alone go to stdout, everything meant for people to stderr
+        utils.records.open(sys.stdout)
+        sys.stdout = sys.stderr
+    try:
+        run(parser, args)
+    finally:
+        utils.records.flush()
+
+
+def run(parser: ArgumentParser, args: Namespace) -> None:
     action = resolvers.resolve_action_mode(args)
 
     config = resolvers.get_config()
-    username, password = resolvers.get_credentials(config)
-
-    # Login to WeLearn with supplied credentials
-    moodle = MoodleClient(BASEURL)
-    token = moodle.authenticate(username, password)
-    if not token:
-        print("Invalid credentials!")
-        sys.exit(errno.EACCES)
-
-    # Select all courses from config if `ALL` keyword is used
-    if "ALL" in map(str.upper, args.courses):
-        if action == "submissions":
-            args.courses = list(resolvers.resolve_submission_details(config).keys())
-        else:
-            args.courses = resolvers.get_all_courses(config)
+
+    # Pruning the link cache is purely local, so it does not need a login
+    if action == "prune":
+        prefix_path = resolvers.resolve_prefix_path(config, args)
+        handler.handle_prune(config, os.path.join(prefix_path, LINK_CACHE))
+        return
+
+    resolve_settings(config, args)
+    moodle = login(config, args)
+
+    if action == "daemon":
+        from welearnbot.daemon import Daemon
+
+        Daemon(parser, config, moodle).run()
+    else:
+        run_action(action, args, config, moodle)
+
+    if args.verbose and action != "daemon":
+        print(
+            f"Session memo: {moodle.memo_hits} hits, {moodle.memo_misses} misses, "
+            f"{moodle.coalesced} coalesced"
+        )
+        if moodle.cache is not None:
+            cache = moodle.cache
+            print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+        print(f"Re-authenticated {moodle.reauth_count} times")
+
+    if moodle.profiler is not None:
+        write_profile(moodle.profiler, args.profile)
+
+
+def resolve_settings(config: RawConfigParser, args: Namespace) -> None:
+    # Download settings, stored alongside the other options
+    args.jobs = resolvers.resolve_jobs(config, args)
+    args.chunk_size = resolvers.resolve_chunk_size(config)
+    args.concurrency = resolvers.resolve_concurrency(config)
+    args.dedupe = resolvers.resolve_dedupe(config, args)
+    args.extract = resolvers.resolve_extract(config, args)
+    args.prune_extracted = resolvers.resolve_prune_extracted(config)
+    args.download_order = resolvers.resolve_download_order(config)
+    args.bandwidth = resolvers.resolve_bandwidth(config, args)
+
+
+def login(config: RawConfigParser, args: Namespace) -> MoodleClient:
+    baseurl = resolvers.resolve_baseurl(config)
+    scheduler = RequestScheduler(**resolvers.resolve_network_settings(config))
+    moodle = MoodleClient(baseurl, pool_size=args.jobs, scheduler=scheduler)
+    if args.profile:
+        moodle.profiler = Profiler()
+    token_filepath = os.path.expanduser(TOKEN_CACHE)
+
+    def authenticate() -> str:
+        # Login to WeLearn with supplied credentials
+        username, password = resolvers.get_credentials(config)
+        token = moodle.authenticate(username, password)
+        if not token:
+            print("Invalid credentials!")
+            sys.exit(errno.EACCES)
+        utils.save_token(token_filepath, baseurl, username, token)
+        return token
+
+    # Reuse the token of an earlier run by the configured account, and only
+    # ask for credentials once WeLearn rejects it
+    username = resolvers.get_username(config)
+    moodle.token = (
+        utils.read_token(token_filepath, baseurl, username) or authenticate()
+    )
+    moodle.reauthenticate = authenticate
+
+    # Cache slow, rarely changing web service responses between runs
+    prefix_path = resolvers.resolve_prefix_path(config, args)
+    moodle.cache = resolvers.resolve_response_cache(config, prefix_path)
+    moodle.bypass_cache = args.no_cache
+    if args.no_cache:
+        # Later runs should not fall back on the responses cached before either
+        moodle.clear_cache()
+    return moodle
+
+
+def write_profile(profiler: Profiler, trace_filepath: str) -> None:
+    """Print the timing summary, and save it next to the trace of the run"""
+    summary = profiler.format_summary()
+    print(summary)
+    profiler.write_trace(trace_filepath)
+    summary_filepath = os.path.splitext(trace_filepath)[0] + ".summary.txt"
+    with open(summary_filepath, "w") as summary_file:
+        summary_file.write(summary + "\n")
+    print(f"Saved the trace to {trace_filepath} and the summary to {summary_filepath}")
+
+
+def run_action(
+    action: str, args: Namespace, config: RawConfigParser, moodle: MoodleClient
+) -> Optional[utils.FileStatuses]:
+    """Run one action, returning the file statuses of actions that download"""
+    resolvers.expand_all_courses(config, args, action)
 
     ignore_types = resolvers.resolve_ignore_types(config, args)
 
@@ -42,6 +139,7 @@ def main():
 
     # Store cache file paths
     link_cache_filepath = os.path.join(prefix_path, LINK_CACHE)
+    intro_cache_filepath = os.path.join(prefix_path, INTRO_CACHE)
 
     common_args = (
         args,
@@ -50,7 +148,7 @@ def main():
         ignore_types,
         prefix_path,
         link_cache_filepath,
-        token,
+        moodle.token,
     )
     # Action picker
     if action == "whoami":
@@ -60,16 +158,20 @@ def main():
         handler.handle_courses(moodle)
 
     elif action == "assignments":
-        handler.handle_assignments(*common_args)
+        with intro.memo.saved(intro_cache_filepath):
+            return handler.handle_assignments(*common_args)
 
     elif action == "submissions":
-        handler.handle_submissions(*common_args)
+        return handler.handle_submissions(*common_args)
 
     elif action == "urls":
-        handler.handle_urls(args, moodle)
+        with intro.memo.saved(intro_cache_filepath):
+            handler.handle_urls(args, moodle)
 
     elif action == "files":
-        handler.handle_files(*common_args)
+        return handler.handle_files(*common_args)
+
+    return None
 
 
 if __name__ == "__main__":